@@ -1,29 +1,132 @@
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Optional
+import jwt
+from jwt import PyJWKClient
 from fastapi import Security, HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from core.config import get_settings
+from core.executor import db_executor, ExecutorBusy
+from core.cache import TTLCache
 
 security = HTTPBearer()
 settings = get_settings()
 
+# One client per process, created on first use. Its HTTP clients keep connections alive,
+# so requests after the first skip client construction and the TCP/TLS handshake.
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+
 def get_supabase() -> Client:
+    global _client
+    if _client is not None:
+        return _client
+    # Called from executor threads as well as the event loop
+    with _client_lock:
+        if _client is None:
+            try:
+                _client = create_client(
+                    settings.SUPABASE_URL,
+                    settings.SUPABASE_KEY,
+                    # Server-side client: no user session to persist or refresh in the background
+                    options=ClientOptions(
+                        postgrest_client_timeout=settings.DB_CALL_TIMEOUT_SEC,
+                        auto_refresh_token=False,
+                        persist_session=False
+                    )
+                )
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to connect to Supabase: {str(e)}"
+                )
+    return _client
+
+# Verified users keyed by SHA-256 of the token, kept no longer than the token is valid
+token_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SEC)
+
+# Supabase projects with asymmetric signing keys publish them here; PyJWKClient caches the set
+_jwks_client = PyJWKClient(settings.SUPABASE_JWKS_URL, cache_keys=True) if settings.SUPABASE_JWKS_URL else None
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _user_from_claims(claims: dict) -> dict:
+    # Same shape as the mock user, so routers can use user.get("id") either way
+    return {
+        "id": claims.get("sub"),
+        "email": claims.get("email"),
+        "aud": claims.get("aud"),
+        "role": claims.get("role")
+    }
+
+async def _verify_locally(credentials: str) -> Optional[dict]:
+    """
+    Checks signature, expiry and audience without calling Supabase.
+    Returns the claims, or None if no local key is configured or the key set can't be fetched.
+    Raises jwt.InvalidTokenError for a bad token.
+    """
+    if settings.SUPABASE_JWT_SECRET:
+        key, algorithms = settings.SUPABASE_JWT_SECRET, ["HS256"]
+    elif _jwks_client is not None:
+        try:
+            # Only hits the network when the key id isn't in the cached set
+            signing_key = await db_executor.run(_jwks_client.get_signing_key_from_jwt, credentials)
+        except (jwt.PyJWKClientError, asyncio.TimeoutError, ExecutorBusy) as e:
+            print(f"JWKS unavailable, falling back to Supabase Auth: {e}")
+            return None
+        key, algorithms = signing_key.key, ["RS256", "ES256"]
+    else:
+        return None
+    return jwt.decode(
+        credentials,
+        key,
+        algorithms=algorithms,
+        audience=settings.SUPABASE_JWT_AUDIENCE,
+        options={"require": ["exp", "sub"]}
+    )
+
+async def _verify_remotely(credentials: str) -> dict:
+    supabase = get_supabase()
+    # Supabase-py's auth.get_user(token) verifies the JWT signature
+    user_response = await db_executor.run(supabase.auth.get_user, credentials)
+
+    if not user_response or not user_response.user:
+        raise _unauthorized("Invalid authentication credentials")
+    user = user_response.user
+    return {"id": user.id, "email": user.email, "aud": user.aud, "role": user.role}
+
+def _seconds_until_expiry(credentials: str) -> float:
     try:
-        # Client creation should ideally be singleton or pooled, 
-        # but superset-py handles connection pooling internally.
-        return create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-    except Exception as e:
-         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to connect to Supabase: {str(e)}"
-        )
+        claims = jwt.decode(credentials, options={"verify_signature": False})
+        return float(claims["exp"]) - time.time()
+    except Exception:
+        return 0.0
 
 async def get_current_user(token: HTTPAuthorizationCredentials = Security(security)):
     """
-    Verifies the JWT token with Supabase Auth.
-    Returns the user object if valid.
+    Verifies the JWT token.
+    Tokens are checked locally (SUPABASE_JWT_SECRET or a cached JWKS) when configured,
+    otherwise with a call to Supabase Auth; verified users are cached until the token expires.
+    Returns the user as a dict (id, email, aud, role).
+    """
+    return await verify_token(token.credentials)
+
+async def verify_token(credentials: str) -> dict:
+    """
+    Same checks as get_current_user for a raw token, e.g. one a WebSocket client sent as a
+    query parameter. Raises HTTPException 401 if it isn't valid.
     """
-    credentials = token.credentials
-    
+    if not credentials:
+        raise _unauthorized("Missing authentication token")
+
     # [NEW] Mock Token Check
     if credentials == "mock-token-123":
         return {
@@ -33,23 +136,26 @@ async def get_current_user(token: HTTPAuthorizationCredentials = Security(securi
             "role": "authenticated"
         }
 
-    supabase = get_supabase()
-    
+    cache_key = hashlib.sha256(credentials.encode()).digest()
+    user = token_cache.get(cache_key)
+    if user is not None:
+        return user
+
+    try:
+        claims = await _verify_locally(credentials)
+    except jwt.InvalidTokenError as e:
+        raise _unauthorized(f"Could not validate credentials: {str(e)}")
+
+    if claims is not None:
+        user = _user_from_claims(claims)
+        token_cache.set(cache_key, user, ttl=float(claims["exp"]) - time.time())
+        return user
+
     try:
-        # Supabase-py's auth.get_user(token) verifies the JWT signature
-        user_response = supabase.auth.get_user(credentials)
-        
-        if not user_response or not user_response.user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return user_response.user
-        
+        user = await _verify_remotely(credentials)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Could not validate credentials: {str(e)}",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _unauthorized(f"Could not validate credentials: {str(e)}")
+    token_cache.set(cache_key, user, ttl=_seconds_until_expiry(credentials))
+    return user
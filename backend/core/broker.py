@@ -0,0 +1,166 @@
+import asyncio
+import struct
+from typing import Callable, Optional, Set
+from urllib.parse import urlparse
+
+# Delivers an already-encoded message to this process's sockets; user_id None = everyone
+Deliver = Callable[[Optional[str], str], None]
+
+# Hub wire format: FRAME_HEADER (payload length, user_id length) + user_id + JSON text, UTF-8.
+# An empty user_id is a broadcast to all users.
+FRAME_HEADER = struct.Struct("<IH")
+
+class InProcessBroker:
+    """Default broker: publishes only reach sockets held by this process."""
+    role = "local"
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+        self.published = 0
+        self.received = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, user_id: Optional[str], text: str):
+        self.published += 1
+        self.deliver(user_id, text)
+
+    def metrics(self) -> dict:
+        return {"role": self.role, "published": self.published, "received": self.received}
+
+class LocalHubBroker(InProcessBroker):
+    """
+    Fans messages out across the worker processes of one machine over a localhost TCP hub
+    (works the same on Windows, where the project is usually run).
+
+    Every worker starts one of these on the same address. The first to bind the port becomes
+    the hub and relays each frame to all other workers; the rest connect to it as peers.
+    If the hub process exits, peers race to take over the port and reconnect.
+    A publish is always delivered locally first, so the hub never echoes a frame back to its sender.
+    """
+    RECONNECT_DELAY = 0.5
+    # A worker that stops reading loses frames instead of growing our send buffer forever
+    MAX_WRITE_BUFFER = 4 * 1024 * 1024
+
+    def __init__(self, deliver: Deliver, host: str = "127.0.0.1", port: int = 8765):
+        super().__init__(deliver)
+        self.host = host
+        self.port = port
+        self.role = "starting"
+        self.dropped = 0
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()  # hub: connected workers
+        self._hub: Optional[asyncio.StreamWriter] = None  # peer: connection to the hub
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for writer in list(self._peers) + ([self._hub] if self._hub else []):
+            writer.close()
+        if self._server:
+            self._server.close()
+            self._server = None
+        self._peers.clear()
+        self._hub = None
+        self.role = "stopped"
+
+    async def publish(self, user_id: Optional[str], text: str):
+        await super().publish(user_id, text)
+        frame = pack_frame(user_id, text)
+        if self._server:
+            self._relay(frame, exclude=None)
+        elif self._hub:
+            self._write(self._hub, frame)
+        else:
+            # Between hub failover and reconnect; other workers miss this message
+            self.dropped += 1
+
+    async def _run(self):
+        while True:
+            try:
+                self._server = await asyncio.start_server(self._serve_peer, self.host, self.port)
+            except OSError:
+                self._server = None
+            if self._server:
+                self.role = "hub"
+                print(f"Broker hub listening on {self.host}:{self.port}")
+                await self._server.serve_forever()
+                return
+
+            try:
+                reader, self._hub = await asyncio.open_connection(self.host, self.port)
+                self.role = "peer"
+                print(f"Broker connected to hub at {self.host}:{self.port}")
+                await self._read_frames(reader, origin=None)
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                if self._hub:
+                    self._hub.close()
+                    self._hub = None
+            self.role = "reconnecting"
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            await self._read_frames(reader, origin=writer)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _read_frames(self, reader: asyncio.StreamReader, origin: Optional[asyncio.StreamWriter]):
+        while True:
+            header = await reader.readexactly(FRAME_HEADER.size)
+            length, user_len = FRAME_HEADER.unpack(header)
+            body = await reader.readexactly(length)
+            if origin is not None:
+                # Hub: pass the frame on to every other worker as-is
+                self._relay(header + body, exclude=origin)
+            user_id = body[:user_len].decode() or None
+            self.received += 1
+            self.deliver(user_id, body[user_len:].decode())
+
+    def _relay(self, frame: bytes, exclude: Optional[asyncio.StreamWriter]):
+        for writer in self._peers:
+            if writer is not exclude:
+                self._write(writer, frame)
+
+    def _write(self, writer: asyncio.StreamWriter, frame: bytes):
+        if writer.transport.get_write_buffer_size() > self.MAX_WRITE_BUFFER:
+            self.dropped += 1
+            return
+        writer.write(frame)
+
+    def metrics(self) -> dict:
+        return {**super().metrics(), "peers": len(self._peers), "dropped": self.dropped}
+
+def pack_frame(user_id: Optional[str], text: str) -> bytes:
+    user = (user_id or "").encode()
+    body = user + text.encode()
+    return FRAME_HEADER.pack(len(body), len(user)) + body
+
+def create_broker(url: str, deliver: Deliver):
+    """
+    Builds the broker for BROKER_URL:
+      "" or "memory://"       - in-process only (single worker)
+      "tcp://127.0.0.1:8765"  - local hub shared by all workers on this machine
+    """
+    if not url or url.startswith("memory://"):
+        return InProcessBroker(deliver)
+    parsed = urlparse(url)
+    if parsed.scheme == "tcp":
+        return LocalHubBroker(deliver, parsed.hostname or "127.0.0.1", parsed.port or 8765)
+    raise ValueError(f"Unsupported BROKER_URL '{url}'")
@@ -0,0 +1,100 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from core.config import get_settings
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire after `ttl` seconds (or a per-entry ttl).
+    Single-threaded use from the event loop; not locked.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]):
+        """Drops every entry whose key matches `predicate`."""
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def metrics(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class UserScopedCache:
+    """
+    TTL cache for per-user read endpoints. invalidate_user() is O(1): it bumps the user's
+    generation, which is part of every key, so older entries are never hit again and age out.
+    Invalidation is per process; with several workers the TTL bounds how stale another
+    worker's entry can be.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = TTLCache(maxsize, ttl)
+        self._generations: Dict[str, int] = {}
+
+    def _key(self, user_id: str, key: Hashable) -> tuple:
+        return (user_id, self._generations.get(user_id, 0), key)
+
+    def get(self, user_id: str, key: Hashable, default: Any = None) -> Any:
+        return self.cache.get(self._key(user_id, key), default)
+
+    def set(self, user_id: str, key: Hashable, value: Any):
+        self.cache.set(self._key(user_id, key), value)
+
+    async def get_or_load(self, user_id: str, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value or awaits loader() and caches its result (None is not cached).
+        The key is fixed before loading, so a load that races with invalidate_user() is stored
+        under the old generation and never served.
+        """
+        full_key = self._key(user_id, key)
+        value = self.cache.get(full_key)
+        if value is None:
+            value = await loader()
+            if value is not None:
+                self.cache.set(full_key, value)
+        return value
+
+    def invalidate_user(self, user_id: str):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def metrics(self) -> dict:
+        return self.cache.metrics()
+
+settings = get_settings()
+# History and insights responses; invalidated by /sessions/start and /sessions/end
+read_cache = UserScopedCache(maxsize=settings.READ_CACHE_SIZE, ttl=settings.READ_CACHE_TTL_SEC)
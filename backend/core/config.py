@@ -8,7 +8,80 @@ class Settings(BaseSettings):
     
     # Supabase (Required)
     SUPABASE_URL: str
-    SUPABASE_KEY: str
+    SUPABASE_KEY: str  # service-role key: background writers (band logs, rollups, spool replay) act for many users
+    
+    # Local JWT verification: the project's JWT secret (HS256) or its JWKS URL
+    # (e.g. https://<project>.supabase.co/auth/v1/.well-known/jwks.json). With neither set,
+    # every new token is checked with a Supabase Auth call.
+    SUPABASE_JWT_SECRET: str = ""
+    SUPABASE_JWKS_URL: str = ""
+    SUPABASE_JWT_AUDIENCE: str = "authenticated"
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL_SEC: float = 300.0
+    
+    # Stream tick rate (Hz); each tick processes 1/STREAM_TICK_HZ seconds of signal
+    STREAM_TICK_HZ: float = 10.0
+    
+    # EEG processing
+    EEG_PROCESSOR_BACKEND: str = "fft"  # fft | sliding_dft
+    EEG_PSD_METHOD: str = "fft"  # fft | welch (fft backend only)
+    EEG_FILTER_ENABLED: bool = True
+    EEG_BANDPASS_LOW_HZ: float = 0.5
+    EEG_BANDPASS_HIGH_HZ: float = 50.0
+    EEG_NOTCH_HZ: float = 50.0  # mains frequency: 50 or 60, 0 disables the notch
+    
+    # Cross-session DSP batching (one stacked FFT per tick for all live streams)
+    DSP_BATCHING_ENABLED: bool = False
+    DSP_BATCH_WINDOW_MS: float = 5.0
+    
+    # Multi-process DSP/AI workers fed through shared memory (0 = run on the event loop)
+    DSP_WORKERS: int = 0
+    DSP_WORKER_SLOTS: int = 256
+    
+    # Per-connection outgoing queue (messages); when full the oldest message is dropped
+    WS_SEND_QUEUE_SIZE: int = 32
+    
+    # Cross-worker fan-out for broadcasts: "memory://" (single process) or
+    # "tcp://127.0.0.1:8765" (local hub shared by all uvicorn workers on this machine)
+    BROKER_URL: str = "memory://"
+    
+    # Per-user cache for history/insights reads
+    READ_CACHE_SIZE: int = 5000
+    READ_CACHE_TTL_SEC: float = 30.0
+    
+    # Blocking Supabase calls run on a bounded thread pool (see core/executor.py)
+    DB_MAX_CONCURRENCY: int = 8
+    DB_MAX_WAITING: int = 100
+    DB_CALL_TIMEOUT_SEC: float = 5.0
+    
+    # Background bulk inserts for eeg_band_logs (see supabase_client/writer.py)
+    EEG_LOG_BATCH_SIZE: int = 250
+    EEG_LOG_FLUSH_INTERVAL_SEC: float = 1.0
+    EEG_LOG_QUEUE_SIZE: int = 20000  # oldest rows are dropped beyond this
+    EEG_LOG_MAX_RETRIES: int = 3
+    EEG_LOG_WRITER_THREADS: int = 1
+    
+    # Local write-ahead spool for DB writes that fail or lag (see supabase_client/spool.py)
+    SPOOL_DIR: str = "spool"
+    SPOOL_SEGMENT_BYTES: int = 16 * 1024 * 1024
+    SPOOL_FSYNC: str = "interval"  # always | interval | never
+    SPOOL_FSYNC_INTERVAL_SEC: float = 1.0
+    SPOOL_REPLAY_INTERVAL_SEC: float = 10.0
+    
+    # Raw-sample archive of recorded sessions (see eeg/archive.py)
+    ARCHIVE_ENABLED: bool = True
+    ARCHIVE_DIR: str = "archive"
+    ARCHIVE_CHUNK_SEC: float = 60.0
+    
+    # Incremental band/state rollups behind /analytics/insights
+    ROLLUP_RETENTION_DAYS: int = 30
+    ROLLUP_FLUSH_INTERVAL_SEC: float = 60.0
+    ROLLUP_IDLE_EVICT_SEC: float = 3600.0  # persisted rollups of users idle this long leave memory
+    
+    # Streaming per-session summaries written by /sessions/end (see eeg/summary.py)
+    ARTIFACT_AMPLITUDE_UV: float = 75.0  # blocks with a sample beyond this count as artifacts
+    SESSION_SUMMARY_IDLE_SEC: float = 6 * 3600  # summaries of sessions never ended are dropped after this
+    SESSION_SUMMARY_FLUSH_INTERVAL_SEC: float = 10.0  # how far behind another worker's part can be at session end
     
     # Safety
     MAX_HEARTBEAT_MISSING_SEC: int = 5
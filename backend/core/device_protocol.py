@@ -0,0 +1,68 @@
+import struct
+import numpy as np
+from typing import Any, Dict, Optional
+
+# Sample-block frames pushed by devices to /ws/ingest. Must match hardware_simulator.py:
+#   magic "NV", version, flags, sequence (u32, wraps), timestamp of the first sample (unix s, f64),
+#   sample_rate (Hz), channels, samples per channel. Little-endian, 22 bytes,
+# followed by channels*samples float32 values, channel-major.
+DEVICE_FRAME_HEADER = struct.Struct("<2sBBIdHHH")
+DEVICE_FRAME_MAGIC = b"NV"
+DEVICE_FRAME_VERSION = 1
+
+SEQ_MODULO = 2 ** 32
+MAX_CHANNELS = 256
+
+class DeviceBlock:
+    """One block of samples from a device. seq/timestamp are None when the device doesn't send them."""
+    def __init__(self, samples: np.ndarray, sample_rate: int, seq: Optional[int] = None,
+                 timestamp: Optional[float] = None):
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.seq = seq
+        self.timestamp = timestamp
+
+    @property
+    def channels(self) -> int:
+        return self.samples.shape[0]
+
+def unpack_device_frame(frame: bytes) -> DeviceBlock:
+    if len(frame) < DEVICE_FRAME_HEADER.size:
+        raise ValueError("Frame shorter than its header")
+    magic, version, _flags, seq, timestamp, sample_rate, channels, samples = DEVICE_FRAME_HEADER.unpack_from(frame)
+    if magic != DEVICE_FRAME_MAGIC or version != DEVICE_FRAME_VERSION:
+        raise ValueError("Not a Neurovex device frame")
+    expected = DEVICE_FRAME_HEADER.size + channels * samples * 4
+    if len(frame) != expected:
+        raise ValueError(f"Frame is {len(frame)} bytes, header says {expected}")
+    if not 0 < channels <= MAX_CHANNELS or sample_rate == 0:
+        raise ValueError("Invalid channel count or sample rate")
+    if samples == 0:
+        raise ValueError("Frame carries no samples")
+    values = np.frombuffer(frame, dtype="<f4", count=channels * samples, offset=DEVICE_FRAME_HEADER.size)
+    return DeviceBlock(values.reshape(channels, samples), sample_rate, seq, timestamp)
+
+def parse_device_message(message: Dict[str, Any], default_sample_rate: int) -> DeviceBlock:
+    """
+    JSON block as sent by hardware_simulator.py --format json:
+        {"timestamp": ..., "seq": ..., "samples": [[ch0...], [ch1...]], "device_info": {"sample_rate": ...}}
+    Devices that only send the latest value per channel ("channels": [...]) give one-sample blocks.
+    """
+    if "samples" in message:
+        samples = np.asarray(message["samples"], dtype=float)
+    elif "channels" in message:
+        samples = np.asarray(message["channels"], dtype=float).reshape(-1, 1)
+    else:
+        raise ValueError("Message has no 'samples' or 'channels'")
+    if samples.ndim != 2 or not 0 < samples.shape[0] <= MAX_CHANNELS or samples.shape[1] == 0:
+        raise ValueError(f"Expected a (channels, samples) array, got shape {samples.shape}")
+
+    sample_rate = int(message.get("device_info", {}).get("sample_rate") or message.get("sample_rate") or default_sample_rate)
+    seq = message.get("seq")
+    timestamp = message.get("timestamp")
+    return DeviceBlock(
+        samples,
+        sample_rate,
+        int(seq) % SEQ_MODULO if seq is not None else None,
+        float(timestamp) if timestamp is not None else None
+    )
@@ -0,0 +1,82 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from core.config import get_settings
+
+class ExecutorBusy(Exception):
+    """Raised when too many calls are already waiting for a slot."""
+
+class BlockingExecutor:
+    """
+    Runs blocking calls (supabase-py's .execute(), auth lookups) off the event loop.
+
+    - At most `max_concurrency` calls run at once, on a dedicated thread pool.
+    - At most `max_waiting` more may queue for a slot; beyond that run() fails fast with ExecutorBusy
+      instead of letting requests pile up behind a slow database.
+    - Each call is bounded by `timeout` seconds (asyncio.TimeoutError). The worker thread itself
+      can't be interrupted, so it still holds its slot until the call returns.
+    """
+    def __init__(self, max_concurrency: int, timeout: float, max_waiting: int = 100, name: str = "blocking"):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+        # Metrics
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        if self._slots.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ExecutorBusy(f"{self.waiting} calls already waiting")
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, fn, *args)
+        # The slot is released when the thread finishes, not when the caller stops waiting
+        future.add_done_callback(lambda _: self._release())
+        self.active += 1
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        return result
+
+    def _release(self):
+        self.active -= 1
+        self._slots.release()
+
+    def metrics(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
+
+settings = get_settings()
+# Shared by every request-path Supabase call (sessions, history, auth fallback)
+db_executor = BlockingExecutor(
+    max_concurrency=settings.DB_MAX_CONCURRENCY,
+    timeout=settings.DB_CALL_TIMEOUT_SEC,
+    max_waiting=settings.DB_MAX_WAITING,
+    name="supabase"
+)
@@ -0,0 +1,232 @@
+import struct
+import numpy as np
+from typing import Dict, Any, List, Optional, Union
+
+from eeg.ai_engine import STATE_CODES
+from eeg.spectral import BAND_NAMES
+
+# WebSocket subprotocol a client offers (Sec-WebSocket-Protocol) to receive binary frames
+BINARY_SUBPROTOCOL = "neurovex.bin.v1"
+
+# Binary tick frame header, little-endian, 20 bytes:
+#   magic "NS", version, flags, timestamp (unix s, f64), state code (see ai_engine.STATES),
+#   channel count, samples per channel, confidence (f32)
+# followed by float32 signal (channels x samples, channel-major) and, if FLAG_HAS_BANDS,
+# float32 band powers (5, BAND_NAMES order). With FLAG_ENVELOPE the signal section is
+# (channels x 2 x samples): per channel the decimated minima row, then the maxima row.
+FRAME_HEADER = struct.Struct("<2sBBdBBHf")
+FRAME_MAGIC = b"NS"
+FRAME_VERSION = 1
+
+# Header flag bits
+FLAG_RECORDING = 0x01
+FLAG_SAFETY_LOCK = 0x02
+FLAG_HAS_BANDS = 0x04
+FLAG_HAS_ANALYSIS = 0x08
+FLAG_ENVELOPE = 0x10
+
+# Fields a client can subscribe to, in payload order
+STREAM_FIELDS = ("signal", "bands", "analysis", "hardware", "status")
+
+# Meta values that move almost every tick (actuator outputs, device counters). A change to
+# only these doesn't trigger a meta frame; they go out with the field's next one, and at
+# least every META_REFRESH_SEC while they keep changing.
+VOLATILE_ACTUATOR_KEYS = ("brightness", "speed", "direction")
+VOLATILE_STATUS_KEYS = ("blocks", "gaps", "missing_samples", "late_blocks", "resets")
+META_REFRESH_SEC = 1.0
+
+Message = Union[Dict[str, Any], bytes]
+
+class Envelope:
+    """Min/max envelope of a decimated (channels, samples) signal."""
+    def __init__(self, minima: np.ndarray, maxima: np.ndarray, factor: int):
+        self.minima = minima
+        self.maxima = maxima
+        self.factor = factor
+
+def envelope(signal: np.ndarray, factor: int) -> Envelope:
+    """
+    Decimates by `factor` keeping each group's min and max, so spikes and blinks survive
+    (a plain stride would alias them away). A trailing partial group is kept.
+    """
+    signal = np.atleast_2d(signal)
+    starts = np.arange(0, signal.shape[-1], factor)
+    return Envelope(
+        np.minimum.reduceat(signal, starts, axis=-1),
+        np.maximum.reduceat(signal, starts, axis=-1),
+        factor
+    )
+
+class Subscription:
+    """
+    Which fields a client receives and how often.
+
+    Set with the stream command
+        {"action": "subscribe",
+         "fields": {"analysis": {"rate": 2}, "signal": {"rate": 10, "decimate": 5}}}
+    or the short form {"action": "subscribe", "fields": ["analysis", "bands"]} (full rate).
+    Rates are in Hz and rounded to a whole number of ticks; unlisted fields are not sent.
+    The default subscription is every field at full rate with no decimation.
+    """
+    def __init__(self, tick_hz: float, fields: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.tick_hz = tick_hz
+        if fields is None:
+            fields = {name: {} for name in STREAM_FIELDS}
+
+        self.every: Dict[str, int] = {}
+        for name, options in fields.items():
+            if name not in STREAM_FIELDS:
+                raise ValueError(f"Unknown stream field '{name}'")
+            rate = float(options.get("rate", tick_hz))
+            if rate <= 0:
+                raise ValueError(f"Rate for '{name}' must be positive")
+            self.every[name] = max(1, int(round(tick_hz / rate)))
+
+        self.decimate = max(1, int(fields.get("signal", {}).get("decimate", 1)))
+
+    @classmethod
+    def from_command(cls, command: Dict[str, Any], tick_hz: float) -> "Subscription":
+        fields = command.get("fields", {})
+        if isinstance(fields, list):
+            fields = {name: {} for name in fields}
+        return cls(tick_hz, fields)
+
+    def due(self, tick_index: int) -> List[str]:
+        """Fields to send on this tick."""
+        return [name for name, every in self.every.items() if tick_index % every == 0]
+
+class JSONStreamEncoder:
+    """Default encoder: a JSON payload with every due field (what existing clients expect)."""
+    subprotocol = None
+
+    def encode(self, timestamp: float, fields: Dict[str, Any]) -> List[Message]:
+        if not fields:
+            return []
+        payload: Dict[str, Any] = {"timestamp": timestamp}
+        for name in STREAM_FIELDS:
+            if name not in fields:
+                continue
+            value = fields[name]
+            if name == "signal":
+                if isinstance(value, Envelope):
+                    value = {"decimation": value.factor, "min": value.minima.tolist(), "max": value.maxima.tolist()}
+                else:
+                    value = value.tolist()
+            payload[name] = value
+        return [payload]
+
+class BinaryStreamEncoder:
+    """
+    Compact encoder for clients that negotiated BINARY_SUBPROTOCOL.
+    Signal, bands and analysis go in one binary frame packed straight from the NumPy
+    buffers. Hardware, status and the analysis reason text go out as a JSON text frame
+    ({"type": "meta", ...}) only when their stable part changes (see _stable), or every
+    `refresh_sec` while only volatile values moved.
+    """
+    subprotocol = BINARY_SUBPROTOCOL
+
+    def __init__(self, refresh_sec: float = META_REFRESH_SEC):
+        self.refresh_sec = refresh_sec
+        self._last_meta: Dict[str, Any] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._status: Dict[str, Any] = {}
+
+    def encode(self, timestamp: float, fields: Dict[str, Any]) -> List[Message]:
+        messages: List[Message] = []
+
+        meta = {name: fields[name] for name in ("hardware", "status") if name in fields}
+        if "analysis" in fields:
+            meta["analysis"] = {"state": fields["analysis"]["state"], "reason": fields["analysis"]["reason"]}
+        changed = {}
+        for name, value in meta.items():
+            last = self._last_meta.get(name)
+            if (last is None or _stable(name, value) != _stable(name, last)
+                    or (value != last and timestamp - self._last_sent[name] >= self.refresh_sec)):
+                changed[name] = value
+        if changed:
+            self._last_meta.update(changed)
+            self._last_sent.update(dict.fromkeys(changed, timestamp))
+            messages.append({"type": "meta", **changed})
+        if "status" in fields:
+            self._status = fields["status"]
+
+        if any(name in fields for name in ("signal", "bands", "analysis")):
+            messages.append(pack_frame(timestamp, fields.get("signal"), fields.get("bands"),
+                                       fields.get("analysis"), self._status))
+        return messages
+
+def _stable(name: str, value: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a meta field whose change is worth a frame of its own."""
+    if name == "analysis":
+        # Reason text quotes a percentage that moves every tick
+        return {"state": value["state"]}
+    if name == "hardware":
+        return {device: {k: v for k, v in status.items() if k not in VOLATILE_ACTUATOR_KEYS}
+                for device, status in value.items()}
+    if name == "status":
+        return {k: v for k, v in value.items() if k not in VOLATILE_STATUS_KEYS}
+    return value
+
+def pack_frame(timestamp: float, signal, bands: Optional[Dict[str, float]], analysis: Optional[Dict[str, Any]],
+               status: Dict[str, Any]) -> bytes:
+    flags = (FLAG_RECORDING if status.get("recording") else 0) | (FLAG_SAFETY_LOCK if status.get("safety_lock") else 0)
+    parts = []
+
+    if signal is None:
+        channels, samples = 0, 0
+    elif isinstance(signal, Envelope):
+        flags |= FLAG_ENVELOPE
+        channels, samples = signal.minima.shape
+        parts.append(np.stack([signal.minima, signal.maxima], axis=1).astype("<f4").tobytes())
+    else:
+        signal = np.atleast_2d(signal)
+        channels, samples = signal.shape
+        parts.append(signal.astype("<f4", copy=False).tobytes())
+
+    if bands is not None:
+        flags |= FLAG_HAS_BANDS
+        parts.append(np.fromiter((bands[name] for name in BAND_NAMES), dtype="<f4", count=len(BAND_NAMES)).tobytes())
+
+    state, confidence = STATE_CODES["unknown"], 0.0
+    if analysis is not None:
+        flags |= FLAG_HAS_ANALYSIS
+        state, confidence = STATE_CODES.get(analysis["state"], STATE_CODES["unknown"]), analysis["confidence"]
+
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, timestamp, state, channels, samples, confidence)
+    return b"".join([header] + parts)
+
+def unpack_frame(frame: bytes) -> Dict[str, Any]:
+    """Decodes a binary tick frame (used by load_test_stream.py and binary clients written in Python)."""
+    magic, version, flags, timestamp, state, channels, samples, confidence = FRAME_HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a Neurovex stream frame")
+    offset = FRAME_HEADER.size
+
+    decoded: Dict[str, Any] = {
+        "version": version,
+        "timestamp": timestamp,
+        "recording": bool(flags & FLAG_RECORDING),
+        "safety_lock": bool(flags & FLAG_SAFETY_LOCK),
+    }
+    if flags & FLAG_ENVELOPE:
+        values = np.frombuffer(frame, dtype="<f4", count=channels * 2 * samples, offset=offset)
+        offset += values.nbytes
+        values = values.reshape(channels, 2, samples)
+        decoded["signal_min"], decoded["signal_max"] = values[:, 0], values[:, 1]
+    elif channels:
+        signal = np.frombuffer(frame, dtype="<f4", count=channels * samples, offset=offset)
+        offset += signal.nbytes
+        decoded["signal"] = signal.reshape(channels, samples)
+    if flags & FLAG_HAS_BANDS:
+        bands = np.frombuffer(frame, dtype="<f4", count=len(BAND_NAMES), offset=offset)
+        decoded["bands"] = dict(zip(BAND_NAMES, bands.tolist()))
+    if flags & FLAG_HAS_ANALYSIS:
+        decoded["state"] = state
+        decoded["confidence"] = confidence
+    return decoded
+
+def select_encoder(offered_subprotocols: List[str]):
+    """Picks the encoder for a connection from the subprotocols the client offered."""
+    if BINARY_SUBPROTOCOL in offered_subprotocols:
+        return BinaryStreamEncoder()
+    return JSONStreamEncoder()
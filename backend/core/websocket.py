@@ -1,35 +1,182 @@
-from typing import List, Dict
+import asyncio
+import json
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Union
 from fastapi import WebSocket
+from core.config import get_settings
+from core.broker import create_broker
+
+Outgoing = Union[str, bytes]
+
+# Device results from /ws/ingest (encode_json keeps key order, so "type" leads)
+DEVICE_PREFIX = '{"type":"device"'
+
+def encode_json(message: dict) -> str:
+    """Same compact encoding Starlette's send_json uses; done once per message, not per socket."""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+class ConnectionWriter:
+    """
+    Owns the outgoing side of one WebSocket: a bounded queue drained by its own task.
+    A slow or stalled client only fills its own queue; when full, the oldest message
+    is dropped (stale ticks are worthless) and counted.
+    Meta frames ({"type": "meta", ...}, sent only on change) must never be dropped, so they
+    skip the queue: pending ones are merged into one frame that goes out before the next
+    queued message.
+    `render`, if set, turns device results into this connection's own messages (dicts are meta).
+    """
+    def __init__(self, websocket: WebSocket, max_queue: int, render: Optional[Callable[[dict], List[Outgoing]]] = None):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.render = render
+        self.queue: deque = deque()
+        self.meta: Optional[dict] = None
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, message: Outgoing):
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(message)
+        self._wakeup.set()
+
+    def enqueue_meta(self, meta: dict):
+        if self.closed:
+            return
+        if self.meta is None:
+            self.meta = dict(meta)
+        else:
+            # Later values of a field replace earlier ones; the newest state is what matters
+            self.meta.update(meta)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if self.meta is not None:
+                message, self.meta = encode_json(self.meta), None
+            elif self.queue:
+                message = self.queue.popleft()
+            else:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+                self.sent += 1
+            except Exception:
+                # Socket is gone; the endpoint's reader will see the disconnect and clean up
+                self.closed = True
+                self.dropped += len(self.queue)
+                self.queue.clear()
+                return
+
+    def close(self):
+        self.closed = True
+        self._task.cancel()
 
 class ConnectionManager:
     def __init__(self):
-        # Store active connections: {user_id: [WebSocket, ...]}
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        # Store active connections: {user_id: {ConnectionWriter, ...}}
+        self.active_connections: Dict[str, Set[ConnectionWriter]] = {}
+        self._writers: Dict[WebSocket, ConnectionWriter] = {}
+        settings = get_settings()
+        self.max_queue = settings.WS_SEND_QUEUE_SIZE
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+        # Carries broadcasts to the sockets of every worker process (see core/broker.py);
+        # started and stopped by the app lifespan
+        self.broker = create_broker(settings.BROKER_URL, self._deliver)
+
+        # Totals carried over from closed connections, for metrics
+        self._closed_sent = 0
+        self._closed_dropped = 0
+
+    async def connect(self, websocket: WebSocket, user_id: str, subprotocol: Optional[str] = None,
+                      render: Optional[Callable[[dict], List[Outgoing]]] = None):
+        await websocket.accept(subprotocol=subprotocol)
+        writer = ConnectionWriter(websocket, self.max_queue, render)
+        self._writers[websocket] = writer
+        self.active_connections.setdefault(user_id, set()).add(writer)
 
     def disconnect(self, websocket: WebSocket, user_id: str):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
+        writer = self._writers.pop(websocket, None)
+        if writer is None:
+            return
+        writer.close()
+        self._closed_sent += writer.sent
+        self._closed_dropped += writer.dropped
+        user_conns = self.active_connections.get(user_id)
+        if user_conns is not None:
+            user_conns.discard(writer)
+            if not user_conns:
                 del self.active_connections[user_id]
 
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        self._enqueue(websocket, encode_json(message))
+
+    async def send_personal_bytes(self, data: bytes, websocket: WebSocket):
+        self._enqueue(websocket, data)
+
+    async def send_personal_meta(self, meta: dict, websocket: WebSocket):
+        """Sends a meta frame outside the drop-oldest queue (coalesced, never dropped)."""
+        writer = self._writers.get(websocket)
+        if writer is not None:
+            writer.enqueue_meta(meta)
 
     async def broadcast(self, message: dict):
-        for user_conns in self.active_connections.values():
-            for connection in user_conns:
-                await connection.send_json(message)
-                
+        # Serialize once; the broker hands the same string to every process
+        await self.broker.publish(None, encode_json(message))
+
     async def broadcast_to_user(self, user_id: str, message: dict):
-        if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
-                await connection.send_json(message)
+        await self.broker.publish(user_id, encode_json(message))
+
+    def _deliver(self, user_id: Optional[str], text: str):
+        """Broker callback: enqueue an encoded message on this process's matching connections."""
+        if user_id is None:
+            targets = [writer for user_conns in self.active_connections.values() for writer in user_conns]
+        else:
+            targets = self.active_connections.get(user_id, ())
+        device = None
+        for writer in targets:
+            if writer.render is not None and text.startswith(DEVICE_PREFIX):
+                # Decoded once per process, then encoded per connection (encoder + subscription)
+                if device is None:
+                    device = json.loads(text)
+                try:
+                    for message in writer.render(device):
+                        if isinstance(message, dict):
+                            writer.enqueue_meta(message)
+                        else:
+                            writer.enqueue(message)
+                except Exception as e:
+                    print(f"Device result render error: {e}")
+            else:
+                writer.enqueue(text)
+
+    def _enqueue(self, websocket: WebSocket, message: Outgoing):
+        writer = self._writers.get(websocket)
+        if writer is not None:
+            writer.enqueue(message)
+
+    def metrics(self) -> dict:
+        writers = list(self._writers.values())
+        depths = [len(writer.queue) for writer in writers]
+        return {
+            "active_users": len(self.active_connections),
+            "active_connections": len(writers),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "messages_sent": self._closed_sent + sum(writer.sent for writer in writers),
+            "messages_dropped": self._closed_dropped + sum(writer.dropped for writer in writers),
+            "broker": self.broker.metrics(),
+        }
 
 manager = ConnectionManager()
@@ -1,4 +1,48 @@
-from typing import Dict, Any
+import numpy as np
+from typing import Dict, Any, List
+from eeg.spectral import BAND_NAMES
+
+# State codes used by analyze_batch, in rule order after "unknown"
+STATES = ("unknown", "focus", "relax", "fatigue", "stress", "neutral")
+STATE_CODES = {name: code for code, name in enumerate(STATES)}
+
+# Reason templates per state code; "{pct}" is the relative band power that triggered the rule
+REASONS = (
+    "No signal detected.",
+    "High Beta ({pct}%) activity indicates active concentration.",
+    "Dominant Alpha ({pct}%) waves indicate a calm, wakeful state.",
+    "Elevated Theta ({pct}%) suggests drowsiness or fatigue.",
+    "Abnormal Gamma spikes detected, correlating with high stress.",
+    "Balanced spectral power distribution.",
+)
+
+class AnalysisBatch:
+    """
+    Result of AIEngine.analyze_batch, kept as arrays.
+    Reason strings are only formatted when a row is serialized with to_dict/to_dicts.
+    """
+    def __init__(self, states: np.ndarray, confidences: np.ndarray, reasons: np.ndarray, reason_values: np.ndarray):
+        self.states = states                # (N,) int8 codes into STATES
+        self.confidences = confidences      # (N,) float, rounded to 2 decimals
+        self.reasons = reasons              # (N,) int8 codes into REASONS (same as the state code)
+        self.reason_values = reason_values  # (N,) relative power quoted in the reason text
+
+    def __len__(self):
+        return len(self.states)
+
+    def state_names(self) -> np.ndarray:
+        return np.array(STATES)[self.states]
+
+    def to_dict(self, i: int) -> Dict[str, Any]:
+        """Same shape as AIEngine.analyze for row i."""
+        return {
+            "state": STATES[self.states[i]],
+            "confidence": float(self.confidences[i]),
+            "reason": REASONS[self.reasons[i]].format(pct=int(self.reason_values[i] * 100))
+        }
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [self.to_dict(i) for i in range(len(self))]
 
 class AIEngine:
     def __init__(self):
@@ -71,3 +115,44 @@ class AIEngine:
             "confidence": 0.5,
             "reason": "Balanced spectral power distribution."
         }
+
+    def analyze_batch(self, bands: np.ndarray) -> AnalysisBatch:
+        """
+        Vectorized analyze over an (N, 5) band-power array (columns in BAND_NAMES order),
+        e.g. a week of eeg_band_logs rows or every live session in a tick.
+        Applies the same rules in the same order as analyze: each rule only claims rows
+        that no earlier rule matched.
+        """
+        bands = np.asarray(bands, dtype=float).reshape(-1, len(BAND_NAMES))
+        delta, theta, alpha, beta, gamma = bands.T
+
+        # Summed left to right like sum(bands.values()) so thresholds match analyze exactly
+        total_power = delta + theta + alpha + beta + gamma
+        has_signal = total_power != 0
+        total = np.where(has_signal, total_power, 1.0)
+
+        rel_alpha = alpha / total
+        rel_beta = beta / total
+        rel_theta = theta / total
+        rel_gamma = gamma / total
+
+        count = len(bands)
+        states = np.full(count, STATE_CODES["neutral"], dtype=np.int8)
+        confidences = np.full(count, 0.5)
+        reason_values = np.zeros(count)
+        undecided = np.ones(count, dtype=bool)
+
+        def claim(mask, state, confidence, value):
+            mask = mask & undecided
+            states[mask] = STATE_CODES[state]
+            confidences[mask] = np.broadcast_to(confidence, mask.shape)[mask]
+            reason_values[mask] = np.broadcast_to(value, mask.shape)[mask]
+            undecided[mask] = False
+
+        claim(~has_signal, "unknown", 0.0, 0.0)
+        claim((rel_beta > 0.4) & (rel_beta > rel_alpha), "focus", np.minimum(rel_beta * 2, 1.0), rel_beta)
+        claim(rel_alpha > 0.4, "relax", np.minimum(rel_alpha * 2, 1.0), rel_alpha)
+        claim(rel_theta > 0.35, "fatigue", np.minimum(rel_theta * 2.5, 1.0), rel_theta)
+        claim(rel_gamma > 0.3, "stress", 0.85, rel_gamma)
+
+        return AnalysisBatch(states, np.round(confidences, 2), states.copy(), reason_values)
@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional, Set, Tuple
+from eeg.ai_engine import STATES, STATE_CODES
+
+try:
+    import fcntl
+except ImportError:  # Windows: only writers in this process are excluded
+    fcntl = None
+
+# On-disk layout of one archived stream (root/<session_id>/<stream>/):
+#   meta.json          channels, sample_rate, chunk_samples, created
+#   chunk-000000.f32   preallocated float32 (chunk_samples, channels), time-major, read via np.memmap
+#   blocks.bin         BLOCK_DTYPE record per appended block: first sample index, unix timestamp, length
+#   states.bin         STATE_DTYPE record whenever the AI state changes (codes from ai_engine.STATES)
+#   markers.jsonl      {"sample", "timestamp", "label"} per marker
+# The sample count is derived from the last blocks.bin record, so a crash loses at most the
+# block being written, never the index of what was already on disk.
+BLOCK_DTYPE = np.dtype([("sample", "<i8"), ("timestamp", "<f8"), ("length", "<i4")])
+STATE_DTYPE = np.dtype([("sample", "<i8"), ("state", "u1")])
+CHUNK_PATTERN = "chunk-{:06d}.f32"
+
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+# Archive paths open for writing in this process
+_open_paths: Set[str] = set()
+
+def archive_path(root: str, session_id: str, stream: str = "stream") -> str:
+    return os.path.join(root, _safe_name(session_id), _safe_name(stream))
+
+def _safe_name(name: str) -> str:
+    safe = _SAFE_NAME.sub("_", name)
+    # "." and ".." survive the substitution but would resolve outside the archive root
+    if not safe.strip("."):
+        raise ValueError(f"Invalid archive name '{name}'")
+    return safe
+
+class SessionArchive:
+    """
+    Append-only raw-sample archive for one recording stream.
+    Chunks are preallocated float32 memmaps, so appending a block is a copy into mapped
+    memory; a finished chunk is flushed and unmapped before the next one is created.
+    Reopening an existing archive with the same geometry resumes after its last block.
+    Only one writer at a time: blocks.bin is exclusively locked while the archive is open,
+    and opening an archive someone else is writing raises ValueError.
+    """
+    def __init__(self, path: str, channels: int, sample_rate: int, chunk_seconds: float = 60.0):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+
+        # Unbuffered: every index record reaches the OS as soon as it is written, so a process
+        # crash can't lose index entries for samples already in the (shared) chunk pages
+        self._blocks = self._lock(os.path.join(path, "blocks.bin"))
+        try:
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                if meta["channels"] != channels or meta["sample_rate"] != sample_rate:
+                    raise ValueError(f"Archive {path} has {meta['channels']} ch @ {meta['sample_rate']} Hz, "
+                                     f"not {channels} ch @ {sample_rate} Hz")
+                self.chunk_samples = meta["chunk_samples"]
+            else:
+                self.chunk_samples = max(1, int(chunk_seconds * sample_rate))
+                with open(meta_path, "w") as f:
+                    json.dump({"channels": channels, "sample_rate": sample_rate, "chunk_samples": self.chunk_samples,
+                               "dtype": "float32", "created": time.time()}, f)
+            self._states = open(os.path.join(path, "states.bin"), "ab", buffering=0)
+        except BaseException:
+            self._unlock()
+            raise
+
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.total_samples = _recorded_samples(path)
+        self.last_state: Optional[int] = None
+        self._chunk: Optional[np.memmap] = None
+        self._chunk_number = -1
+
+    def _lock(self, blocks_path: str):
+        """Opens blocks.bin for appending, exclusively; ValueError if another writer has it."""
+        key = os.path.realpath(self.path)
+        if key in _open_paths:
+            raise ValueError(f"Archive {self.path} is already being written")
+        f = open(blocks_path, "ab", buffering=0)
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                raise ValueError(f"Archive {self.path} is already being written by another process")
+        _open_paths.add(key)
+        return f
+
+    def _unlock(self):
+        # Closing the file releases the flock
+        self._blocks.close()
+        _open_paths.discard(os.path.realpath(self.path))
+
+    def append(self, block: np.ndarray, timestamp: float, state: Optional[str] = None):
+        """Appends a (channels, samples) block whose first sample was taken at `timestamp`."""
+        block = np.asarray(block)
+        if block.ndim != 2 or block.shape[0] != self.channels:
+            raise ValueError(f"Expected a ({self.channels}, samples) block, got shape {block.shape}")
+        start = self.total_samples
+        length = block.shape[1]
+
+        written = 0
+        while written < length:
+            position = start + written
+            chunk = self._chunk_for(position // self.chunk_samples)
+            offset = position % self.chunk_samples
+            count = min(length - written, self.chunk_samples - offset)
+            chunk[offset:offset + count] = block[:, written:written + count].T
+            written += count
+
+        self.total_samples += length
+        # Index record last: a block only counts once its samples are in the chunk
+        self._blocks.write(np.array([(start, timestamp, length)], dtype=BLOCK_DTYPE).tobytes())
+        if state is not None:
+            code = STATE_CODES.get(state, STATE_CODES["unknown"])
+            if code != self.last_state:
+                self._states.write(np.array([(start, code)], dtype=STATE_DTYPE).tobytes())
+                self.last_state = code
+
+    def add_marker(self, label: str, timestamp: Optional[float] = None):
+        """Marks the current position (the next sample to be written)."""
+        with open(os.path.join(self.path, "markers.jsonl"), "a") as f:
+            f.write(json.dumps({"sample": self.total_samples, "timestamp": timestamp or time.time(), "label": label}) + "\n")
+
+    def _chunk_for(self, number: int) -> np.memmap:
+        if number != self._chunk_number:
+            self._release_chunk()
+            chunk_path = os.path.join(self.path, CHUNK_PATTERN.format(number))
+            # r+ when resuming into a chunk that already exists, otherwise preallocate it
+            mode = "r+" if os.path.exists(chunk_path) else "w+"
+            self._chunk = np.memmap(chunk_path, dtype="<f4", mode=mode, shape=(self.chunk_samples, self.channels))
+            self._chunk_number = number
+        return self._chunk
+
+    def _release_chunk(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+            self._chunk = None
+
+    def flush(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._blocks.flush()
+        self._states.flush()
+
+    def close(self):
+        self._release_chunk()
+        self._states.close()
+        self._unlock()
+
+def _recorded_samples(path: str) -> int:
+    blocks = _read_records(os.path.join(path, "blocks.bin"), BLOCK_DTYPE)
+    if len(blocks) == 0:
+        return 0
+    return int(blocks["sample"][-1] + blocks["length"][-1])
+
+def _read_records(path: str, dtype: np.dtype) -> np.ndarray:
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=dtype)
+    data = np.fromfile(path, dtype=np.uint8)
+    # Ignore a torn trailing record
+    usable = len(data) - len(data) % dtype.itemsize
+    return data[:usable].view(dtype)
+
+class ArchiveReader:
+    """
+    Random access to an archived stream. Samples are read through np.memmap, so slicing a
+    time range only touches the chunks (and pages) it covers.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.channels = meta["channels"]
+        self.sample_rate = meta["sample_rate"]
+        self.chunk_samples = meta["chunk_samples"]
+        self.blocks = _read_records(os.path.join(path, "blocks.bin"), BLOCK_DTYPE)
+        self.total_samples = _recorded_samples(path)
+        self._chunks: Dict[int, np.memmap] = {}
+
+    @property
+    def duration_sec(self) -> float:
+        return self.total_samples / self.sample_rate
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """Samples [start, stop) as a (channels, samples) float32 array."""
+        start = max(0, start)
+        stop = min(stop, self.total_samples)
+        out = np.empty((self.channels, max(0, stop - start)), dtype=np.float32)
+        position = start
+        while position < stop:
+            number, offset = divmod(position, self.chunk_samples)
+            count = min(stop - position, self.chunk_samples - offset)
+            out[:, position - start:position - start + count] = self._chunk(number)[offset:offset + count].T
+            position += count
+        return out
+
+    def read_time(self, t0: float, t1: float) -> np.ndarray:
+        """Samples between two unix timestamps (mapped through the block index)."""
+        return self.read(self.sample_at(t0), self.sample_at(t1))
+
+    def sample_at(self, timestamp: float) -> int:
+        """Sample index recorded at `timestamp`, using the block that contains it."""
+        if len(self.blocks) == 0:
+            return 0
+        i = max(0, int(np.searchsorted(self.blocks["timestamp"], timestamp, side="right")) - 1)
+        block = self.blocks[i]
+        within = int(round((timestamp - block["timestamp"]) * self.sample_rate))
+        return int(block["sample"]) + min(max(within, 0), int(block["length"]))
+
+    def states(self) -> List[Tuple[int, str]]:
+        """(first sample, state) for each state change."""
+        records = _read_records(os.path.join(self.path, "states.bin"), STATE_DTYPE)
+        return [(int(sample), STATES[code]) for sample, code in records]
+
+    def markers(self) -> List[Dict[str, Any]]:
+        path = os.path.join(self.path, "markers.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _chunk(self, number: int) -> np.memmap:
+        if number not in self._chunks:
+            self._chunks[number] = np.memmap(os.path.join(self.path, CHUNK_PATTERN.format(number)),
+                                             dtype="<f4", mode="r", shape=(self.chunk_samples, self.channels))
+        return self._chunks[number]
+
+def open_archive_from_settings(settings, session_id: str, stream: str, channels: int, sample_rate: int) -> Optional[SessionArchive]:
+    """Opens (or resumes) the archive for a recording, or returns None if archiving is off or not possible."""
+    if not settings.ARCHIVE_ENABLED or not session_id:
+        return None
+    try:
+        return SessionArchive(archive_path(settings.ARCHIVE_DIR, session_id, stream), channels, sample_rate,
+                              chunk_seconds=settings.ARCHIVE_CHUNK_SEC)
+    except (OSError, ValueError) as e:
+        print(f"Raw archive disabled for {session_id}/{stream}: {e}")
+        return None
@@ -0,0 +1,130 @@
+import numpy as np
+from functools import lru_cache
+from typing import Optional, Tuple, List
+
+# Q factors of the two biquads making up a 4th-order Butterworth response
+BUTTERWORTH_Q_ORDER4 = (0.5411961, 1.3065630)
+
+def _biquad(kind: str, freq: float, sample_rate: int, q: float) -> np.ndarray:
+    """
+    RBJ audio-EQ-cookbook biquad as a normalized second-order section
+    [b0, b1, b2, 1, a1, a2] (same row layout as scipy's sos arrays).
+    """
+    w0 = 2 * np.pi * freq / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+
+    if kind == "lowpass":
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+    elif kind == "highpass":
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    elif kind == "notch":
+        b = [1.0, -2 * cos_w0, 1.0]
+    else:
+        raise ValueError(f"Unknown biquad type '{kind}'")
+    a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+
+    return np.array(b + a) / a[0]
+
+def design_sos(sample_rate: int, bandpass: Optional[Tuple[float, float]] = (0.5, 50), notch_hz: Optional[float] = 50.0, notch_q: float = 30.0) -> np.ndarray:
+    """
+    Second-order sections for the EEG front end:
+    4th-order Butterworth high-pass + low-pass (the bandpass) and an optional mains notch.
+    Edges at or above Nyquist are skipped.
+    """
+    nyquist = sample_rate / 2
+    sections: List[np.ndarray] = []
+    if bandpass:
+        low, high = bandpass
+        if low and low > 0:
+            sections += [_biquad("highpass", low, sample_rate, q) for q in BUTTERWORTH_Q_ORDER4]
+        if high and high < nyquist:
+            sections += [_biquad("lowpass", high, sample_rate, q) for q in BUTTERWORTH_Q_ORDER4]
+    if notch_hz and notch_hz < nyquist:
+        sections.append(_biquad("notch", notch_hz, sample_rate, notch_q))
+    return np.array(sections).reshape(-1, 6)
+
+def sosfilt_reference(sos: np.ndarray, x: np.ndarray, zi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sample-by-sample transposed direct form II cascade for a 1-D signal.
+    zi has shape (sections, 2). Slow; only used to derive the block matrices.
+    """
+    z = zi.astype(float).copy()
+    y = np.asarray(x, dtype=float).copy()
+    for n in range(len(y)):
+        value = y[n]
+        for s, (b0, b1, b2, _, a1, a2) in enumerate(sos):
+            out = b0 * value + z[s, 0]
+            z[s, 0] = b1 * value - a1 * out + z[s, 1]
+            z[s, 1] = b2 * value - a2 * out
+            value = out
+        y[n] = value
+    return y, z
+
+@lru_cache(maxsize=64)
+def block_matrices(sos: Tuple[Tuple[float, ...], ...], length: int):
+    """
+    Block state-space matrices (A, B, C, D) of the cascade for `length` samples,
+    derived once from the reference filter and shared by every session.
+    """
+    sos = np.array(sos)
+    sections = len(sos)
+    state_size = 2 * sections
+    zero_state = np.zeros((sections, 2))
+    A = np.empty((state_size, state_size))
+    B = np.empty((state_size, length))
+    C = np.empty((length, state_size))
+    D = np.empty((length, length))
+
+    for j in range(state_size):
+        zi = np.zeros(state_size)
+        zi[j] = 1.0
+        y, z = sosfilt_reference(sos, np.zeros(length), zi.reshape(sections, 2))
+        C[:, j] = y
+        A[:, j] = z.ravel()
+
+    for m in range(length):
+        impulse = np.zeros(length)
+        impulse[m] = 1.0
+        y, z = sosfilt_reference(sos, impulse, zero_state)
+        D[:, m] = y
+        B[:, m] = z.ravel()
+
+    for matrix in (A, B, C, D):
+        matrix.flags.writeable = False
+    return A, B, C, D
+
+class StreamingFilterBank:
+    """
+    Stateful IIR filter (second-order sections) applied chunk by chunk.
+    Filter state persists between chunks, so consecutive chunks are filtered exactly
+    as one continuous signal: no edge transients and no refiltering of the buffer.
+
+    The cascade is linear, so for a block of M samples the output and next state are
+        y = x @ D.T + z @ C.T        z' = x @ B.T + z @ A.T
+    with (A, B, C, D) cached per block length (see block_matrices). Every channel is filtered in the same
+    matrix products instead of a per-sample Python loop.
+    """
+    # Longer blocks are split so the cached (M x M) matrices stay small
+    MAX_BLOCK = 64
+
+    def __init__(self, sample_rate=250, channels=1, bandpass=(0.5, 50), notch_hz=50.0):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sos = design_sos(sample_rate, bandpass=bandpass, notch_hz=notch_hz)
+        self.state_size = 2 * len(self.sos)
+        self.state = np.zeros((channels, self.state_size))
+        self._sos_key = tuple(map(tuple, self.sos))
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Filters a (channels, samples) block and advances the per-channel state."""
+        block = np.asarray(block, dtype=float)
+        if self.state_size == 0:
+            return block
+        out = np.empty_like(block)
+        for start in range(0, block.shape[-1], self.MAX_BLOCK):
+            x = block[:, start:start + self.MAX_BLOCK]
+            A, B, C, D = block_matrices(self._sos_key, x.shape[-1])
+            out[:, start:start + x.shape[-1]] = x @ D.T + self.state @ C.T
+            self.state = x @ B.T + self.state @ A.T
+        return out
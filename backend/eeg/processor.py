@@ -1,47 +1,248 @@
 import numpy as np
-from typing import Dict
+from typing import Dict, Any
+from eeg.spectral import BAND_NAMES, get_band_plan, fft_magnitudes, welch_magnitudes
+from eeg.filters import StreamingFilterBank
+
+PSD_METHODS = ("fft", "welch")
 
 class EEGProcessor:
-    def __init__(self, sample_rate=250):
+    def __init__(self, sample_rate=250, window_sec=2, channels=1, method="fft", welch_segment_sec=1.0,
+                 bandpass=None, notch_hz=None):
+        """
+        method: "fft" (single periodogram over the whole window) or
+                "welch" (averaged 50%-overlapping Hann segments; lower variance, coarser bins)
+        bandpass / notch_hz: optional (low, high) Hz bandpass and mains notch frequency,
+                applied by a stateful streaming filter before samples enter the buffer
+        """
+        if method not in PSD_METHODS:
+            raise ValueError(f"Unknown PSD method '{method}', expected one of {PSD_METHODS}")
         self.sample_rate = sample_rate
-        self.buffer = np.zeros(sample_rate * 2) # 2-second buffer
-        
+        self.channels = channels
+        self.method = method
+        self.window_length = int(sample_rate * window_sec)
+        self.segment_length = min(int(sample_rate * welch_segment_sec), self.window_length)
+
+        # Bin-to-band mapping is cached and shared by every processor with the same geometry
+        fft_length = self.segment_length if method == "welch" else self.window_length
+        self.plan = get_band_plan(sample_rate, fft_length)
+
+        # Streaming IIR front end; its state carries across chunks for this session only
+        self.filter_bank = None
+        if bandpass or notch_hz:
+            self.filter_bank = StreamingFilterBank(sample_rate, channels, bandpass=bandpass, notch_hz=notch_hz)
+
+        # Preallocated circular buffer, one row per channel (2-second window by default).
+        # write_index points at the oldest sample, i.e. the next slot to overwrite.
+        self.buffer = np.zeros((channels, self.window_length))
+        self.write_index = 0
+
+        # Reusable scratch array holding the buffer in chronological order for the FFT
+        self._window = np.empty((channels, self.window_length))
+
     def process_chunk(self, chunk: np.ndarray) -> Dict[str, float]:
         """
         Adds new data chunk, updates buffer, runs FFT, returns Band Powers.
+        Single-channel convenience wrapper around process_block.
         """
-        # Roll buffer and add new data
-        chunk_len = len(chunk)
-        self.buffer = np.roll(self.buffer, -chunk_len)
-        self.buffer[-chunk_len:] = chunk
-        
-        # Compute FFT on the full buffer
-        # In a real medical app, we'd apply a bandpass filter (0.5-50Hz) first here.
-        
-        fft_result = np.fft.rfft(self.buffer)
-        freqs = np.fft.rfftfreq(len(self.buffer), 1/self.sample_rate)
-        
-        # Get magnitude
-        magnitudes = np.abs(fft_result)
-        
-        # Normalize
-        magnitudes = magnitudes / len(self.buffer)
-        
-        # Extract Band Powers (Average magnitude in freq range)
-        bands = {
-            "delta": self._get_band_power(freqs, magnitudes, 0.5, 4),
-            "theta": self._get_band_power(freqs, magnitudes, 4, 8),
-            "alpha": self._get_band_power(freqs, magnitudes, 8, 13),
-            "beta":  self._get_band_power(freqs, magnitudes, 13, 30),
-            "gamma": self._get_band_power(freqs, magnitudes, 30, 50)
+        if self.channels != 1:
+            raise ValueError("process_chunk expects a single-channel processor; use process_block")
+        return self.process_block(np.asarray(chunk, dtype=float).reshape(1, -1))["average"]
+
+    def process_block(self, block: np.ndarray) -> Dict[str, Any]:
+        """
+        Adds a (channels, samples) block and computes band powers for all channels at once.
+        Returns: {
+            "per_channel": np.ndarray of shape (channels, 5), columns ordered as BAND_NAMES,
+            "average": {band: float} averaged across channels
         }
-        
-        return bands
-
-    def _get_band_power(self, freqs, magnitudes, low, high):
-        """Calculates average power in a frequency band."""
-        # Find indices
-        idx = np.logical_and(freqs >= low, freqs <= high)
-        if np.sum(idx) == 0:
-            return 0.0
-        return float(np.mean(magnitudes[idx]))
+        """
+        return self.format_result(self._update(self.prepare(block)))
+
+    # Steps of process_block, exposed separately so BatchedDSPStage can run the
+    # FFT for many sessions at once: prepare/push per session, band_matrix on the
+    # stacked windows, format_result per session.
+
+    @property
+    def batch_key(self):
+        """Processors with equal keys can share one stacked FFT; None means not batchable."""
+        return (self.sample_rate, self.window_length, self.method, self.segment_length)
+
+    def prepare(self, block: np.ndarray) -> np.ndarray:
+        """Validates a (channels, samples) block and runs it through the streaming filter."""
+        block = np.asarray(block, dtype=float)
+        if block.ndim != 2 or block.shape[0] != self.channels:
+            raise ValueError(f"Expected a ({self.channels}, samples) block, got shape {block.shape}")
+        if self.filter_bank is not None:
+            block = self.filter_bank.process(block)
+        return block
+
+    def push(self, block: np.ndarray):
+        """Filters and appends a block without computing band powers."""
+        self._write(self.prepare(block))
+
+    def band_matrix(self, window: np.ndarray) -> np.ndarray:
+        """Runs one batched FFT over every row of (..., window_length) and reduces it to (..., 5) band powers."""
+        if self.method == "welch":
+            magnitudes = welch_magnitudes(window, self.segment_length)
+        else:
+            magnitudes = fft_magnitudes(window)
+
+        # Extract Band Powers (Average magnitude in freq range) in one matrix product
+        return self.plan.band_powers(magnitudes)
+
+    def format_result(self, per_channel: np.ndarray, average=None) -> Dict[str, Any]:
+        """Builds the process_block result; `average` may be passed in when already computed for a batch."""
+        if average is None:
+            average = per_channel.mean(axis=0).tolist()
+        return {
+            "per_channel": per_channel,
+            "average": dict(zip(BAND_NAMES, average))
+        }
+
+    def _update(self, block: np.ndarray) -> np.ndarray:
+        """Appends the block to the window and returns the (channels, 5) band matrix."""
+        self._write(block)
+        return self.band_matrix(self.window())
+
+    def _write(self, block: np.ndarray):
+        """Copies a (channels, samples) block into the circular buffer in place, wrapping at the end."""
+        length = self.window_length
+        chunk_len = block.shape[-1]
+        if chunk_len == 0:
+            return
+        if chunk_len >= length:
+            # Block covers the whole window: keep only the newest samples
+            self.buffer[:] = block[:, -length:]
+            self.write_index = 0
+            return
+
+        start = self.write_index
+        end = start + chunk_len
+        if end <= length:
+            self.buffer[:, start:end] = block
+        else:
+            split = length - start
+            self.buffer[:, start:] = block[:, :split]
+            self.buffer[:, :end - length] = block[:, split:]
+        self.write_index = end % length
+
+    def window(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the (channels, window_length) buffer oldest-to-newest without allocating.
+        When the write index is at 0 the buffer is already in order and is
+        returned directly; otherwise the two halves are copied into the scratch array.
+        If `out` is given (e.g. rows of a batch array) the window is copied there instead.
+        """
+        start = self.write_index
+        if out is None:
+            if start == 0:
+                return self.buffer
+            out = self._window
+        head = self.window_length - start
+        out[:, :head] = self.buffer[:, start:]
+        out[:, head:] = self.buffer[:, :start]
+        return out
+
+
+class SlidingDFTProcessor(EEGProcessor):
+    """
+    Incremental alternative to the full-window FFT.
+    Only the rFFT bins covered by the bands (0.5-50 Hz) are tracked, and they are
+    updated per incoming sample with the sliding DFT recurrence
+        X_k <- (X_k + x_new - x_old) * exp(2j*pi*k/N)
+    A block of M samples is applied in one (M x bins) matrix product, so small,
+    frequent chunks (50-100 Hz feedback) cost O(M * bins) instead of O(N log N).
+    Results match EEGProcessor(method="fft") up to floating point error; the bins are
+    periodically recomputed from the window to keep that error from accumulating.
+    """
+    def __init__(self, sample_rate=250, window_sec=2, channels=1, method="fft", resync_every=100,
+                 bandpass=None, notch_hz=None):
+        if method != "fft":
+            raise ValueError("SlidingDFTProcessor only supports the 'fft' method")
+        super().__init__(sample_rate=sample_rate, window_sec=window_sec, channels=channels, method=method,
+                         bandpass=bandpass, notch_hz=notch_hz)
+        self.resync_every = resync_every
+        self._blocks_since_resync = 0
+
+        # Contiguous bin range spanning every band, and the matching rows of the band weights
+        starts = [s.start for s in self.plan.slices if s.stop > s.start]
+        stops = [s.stop for s in self.plan.slices if s.stop > s.start]
+        self.bins = np.arange(min(starts), max(stops))
+        # Window-length normalization is folded into the weights
+        self._weights = self.plan.weights[self.bins] / self.window_length
+
+        self._twiddle = np.exp(2j * np.pi * self.bins / self.window_length)
+        self._spectrum = np.zeros((channels, len(self.bins)), dtype=complex)
+        self._update_matrices = {}
+
+    @property
+    def batch_key(self):
+        # Bin state is updated incrementally per session, so there is no window FFT to share
+        return None
+
+    def _update(self, block: np.ndarray) -> np.ndarray:
+        length = self.window_length
+        chunk_len = block.shape[-1]
+
+        if chunk_len >= length or self._blocks_since_resync >= self.resync_every:
+            self._write(block)
+            self._resync()
+        elif chunk_len > 0:
+            # Samples about to be overwritten are the oldest ones in the window
+            start = self.write_index
+            if start + chunk_len <= length:
+                delta = block - self.buffer[:, start:start + chunk_len]
+            else:
+                delta = block - np.take(self.buffer, (start + np.arange(chunk_len)) % length, axis=1)
+            self._write(block)
+
+            twiddle_block, update = self._block_matrices(chunk_len)
+            self._spectrum *= twiddle_block
+            self._spectrum += delta @ update
+            self._blocks_since_resync += 1
+
+        return np.abs(self._spectrum) @ self._weights
+
+    def _block_matrices(self, chunk_len: int):
+        """
+        Cached per chunk length: W^M for the existing bins, and the (M x bins)
+        matrix W^(M-m) that folds sample m of the block into every bin.
+        """
+        if chunk_len not in self._update_matrices:
+            powers = chunk_len - np.arange(chunk_len)
+            self._update_matrices[chunk_len] = (
+                self._twiddle ** chunk_len,
+                self._twiddle[np.newaxis, :] ** powers[:, np.newaxis]
+            )
+        return self._update_matrices[chunk_len]
+
+    def _resync(self):
+        """Recomputes the tracked bins exactly from the current window (one full rFFT)."""
+        self._spectrum = np.fft.rfft(self.window(), axis=-1)[:, self.bins]
+        self._blocks_since_resync = 0
+
+PROCESSOR_BACKENDS = {
+    "fft": EEGProcessor,
+    "sliding_dft": SlidingDFTProcessor,
+}
+
+def create_processor(backend: str = "fft", **kwargs) -> EEGProcessor:
+    """Builds the processor backend selected in config (EEG_PROCESSOR_BACKEND)."""
+    if backend not in PROCESSOR_BACKENDS:
+        raise ValueError(f"Unknown EEG processor backend '{backend}', expected one of {tuple(PROCESSOR_BACKENDS)}")
+    return PROCESSOR_BACKENDS[backend](**kwargs)
+
+def processor_options_from_settings(settings) -> Dict[str, Any]:
+    """create_processor keyword arguments (backend, PSD method, filters) taken from Settings."""
+    options = {
+        "backend": settings.EEG_PROCESSOR_BACKEND,
+        "method": settings.EEG_PSD_METHOD,
+    }
+    if settings.EEG_FILTER_ENABLED:
+        options["bandpass"] = (settings.EEG_BANDPASS_LOW_HZ, settings.EEG_BANDPASS_HIGH_HZ)
+        options["notch_hz"] = settings.EEG_NOTCH_HZ or None
+    return options
+
+def create_processor_from_settings(settings, channels: int = 1, sample_rate: int = 250) -> EEGProcessor:
+    """Builds a per-session processor with the backend, PSD method and filters from Settings."""
+    return create_processor(sample_rate=sample_rate, channels=channels, **processor_options_from_settings(settings))
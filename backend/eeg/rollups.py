@@ -0,0 +1,253 @@
+import time
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from eeg.spectral import BAND_NAMES
+from eeg.ai_engine import STATES, STATE_CODES
+
+class RunningStats:
+    """Welford mean/variance over vectors (one value per band), mergeable with Chan's formula."""
+    def __init__(self, size: int = len(BAND_NAMES)):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def add(self, values: np.ndarray):
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    def merge(self, other: "RunningStats"):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / total
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+
+    @property
+    def variance(self) -> np.ndarray:
+        return self.m2 / (self.count - 1) if self.count > 1 else np.zeros_like(self.m2)
+
+class RollupBucket:
+    """Band statistics and time-in-state (seconds, indexed by ai_engine.STATES) for one bucket."""
+    def __init__(self, kind: str, key: str, start: Optional[datetime] = None):
+        self.kind = kind
+        self.key = key
+        self.start = start
+        self.bands = RunningStats()
+        self.state_seconds = np.zeros(len(STATES))
+
+    def add(self, bands: np.ndarray, state_code: int, duration_sec: float):
+        self.bands.add(bands)
+        self.state_seconds[state_code] += duration_sec
+
+    def merge(self, other: "RollupBucket"):
+        self.bands.merge(other.bands)
+        self.state_seconds += other.state_seconds
+        if other.start is not None and (self.start is None or other.start < self.start):
+            self.start = other.start
+
+    @property
+    def total_seconds(self) -> float:
+        return float(self.state_seconds.sum())
+
+    def share(self, state: str) -> float:
+        total = self.total_seconds
+        return float(self.state_seconds[STATE_CODES[state]] / total) if total else 0.0
+
+    def to_row(self, user_id: str) -> Dict[str, Any]:
+        return {
+            "user_id": user_id,
+            "bucket_kind": self.kind,
+            "bucket_key": self.key,
+            "bucket_start": self.start.isoformat() if self.start else None,
+            "sample_count": self.bands.count,
+            "band_mean": self.bands.mean.tolist(),
+            "band_m2": self.bands.m2.tolist(),
+            "state_seconds": dict(zip(STATES, self.state_seconds.tolist())),
+        }
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "RollupBucket":
+        start = datetime.fromisoformat(row["bucket_start"]) if row.get("bucket_start") else None
+        bucket = cls(row["bucket_kind"], row["bucket_key"], start)
+        bucket.bands.count = int(row["sample_count"])
+        bucket.bands.mean = np.asarray(row["band_mean"], dtype=float)
+        bucket.bands.m2 = np.asarray(row["band_m2"], dtype=float)
+        for state, seconds in (row.get("state_seconds") or {}).items():
+            if state in STATE_CODES:
+                bucket.state_seconds[STATE_CODES[state]] = seconds
+        return bucket
+
+class RollupStore:
+    """
+    Per-user rollups maintained as band powers are recorded: one bucket per session, per UTC
+    hour and per UTC day. record() is O(1); insights read a bounded number of buckets, however
+    much raw history the user has. Buckets older than `retention_days` are pruned, and
+    users idle for a while can be evicted once persisted (evict_idle).
+
+    `buckets` holds only what this process recorded; `loaded` holds the buckets other
+    processes persisted, and user_buckets() merges the two, so no process ever writes
+    a bucket that includes another's counts.
+    """
+    def __init__(self, retention_days: int = 30):
+        self.retention_days = retention_days
+        # {user_id: {(kind, key): RollupBucket}} recorded by this process
+        self.buckets: Dict[str, Dict[Tuple[str, str], RollupBucket]] = {}
+        # {user_id: {(kind, key): RollupBucket}} persisted by other processes, combined
+        self.loaded: Dict[str, Dict[Tuple[str, str], RollupBucket]] = {}
+        # (user_id, kind, key) changed since the last persist
+        self.dirty: Set[Tuple[str, str, str]] = set()
+        # Monotonic time each user was last recorded, loaded or read
+        self.last_used: Dict[str, float] = {}
+
+    def record(self, user_id: str, session_id: Optional[str], bands: Dict[str, float], state: str,
+               duration_sec: float, timestamp: float):
+        values = np.fromiter((bands[name] for name in BAND_NAMES), dtype=float, count=len(BAND_NAMES))
+        code = STATE_CODES.get(state, STATE_CODES["unknown"])
+        moment = datetime.fromtimestamp(timestamp, timezone.utc)
+        hour = moment.replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+
+        targets = [("hour", hour.isoformat(), hour), ("day", day.date().isoformat(), day)]
+        if session_id:
+            # A session bucket's start is its first record, which is also what retention uses
+            targets.append(("session", session_id, moment))
+        user_buckets = self.buckets.setdefault(user_id, {})
+        self.last_used[user_id] = time.monotonic()
+        for kind, key, start in targets:
+            bucket = user_buckets.get((kind, key))
+            if bucket is None:
+                bucket = user_buckets[(kind, key)] = RollupBucket(kind, key, start)
+                if kind == "day":
+                    self._prune(user_id, day)
+            bucket.add(values, code, duration_sec)
+            self.dirty.add((user_id, kind, key))
+
+    def set_loaded(self, user_id: str, buckets: Iterable[RollupBucket]):
+        """Replaces the user's buckets from other processes, combining rows for the same bucket."""
+        combined: Dict[Tuple[str, str], RollupBucket] = {}
+        for bucket in buckets:
+            existing = combined.get((bucket.kind, bucket.key))
+            if existing is None:
+                combined[(bucket.kind, bucket.key)] = bucket
+            else:
+                existing.merge(bucket)
+        self.loaded[user_id] = combined
+        self.last_used[user_id] = time.monotonic()
+
+    def touch(self, user_id: str):
+        if user_id in self.buckets or user_id in self.loaded:
+            self.last_used[user_id] = time.monotonic()
+
+    def prune(self, now: Optional[datetime] = None):
+        """Drops buckets past retention for every user (record() only prunes the user it records)."""
+        today = (now or datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+        for user_id in set(self.buckets) | set(self.loaded):
+            self._prune(user_id, today)
+
+    def evict_idle(self, idle_sec: float) -> List[str]:
+        """Forgets users unused for `idle_sec` whose buckets are all persisted. Returns them."""
+        cutoff = time.monotonic() - idle_sec
+        pending = {user_id for user_id, _, _ in self.dirty}
+        evicted = [user_id for user_id in set(self.buckets) | set(self.loaded)
+                   if user_id not in pending and self.last_used.get(user_id, 0.0) < cutoff]
+        for user_id in evicted:
+            self.buckets.pop(user_id, None)
+            self.loaded.pop(user_id, None)
+            self.last_used.pop(user_id, None)
+        return evicted
+
+    def user_buckets(self, user_id: str, kind: str) -> List[RollupBucket]:
+        """The user's `kind` buckets, this process's and other processes' merged."""
+        merged: Dict[str, RollupBucket] = {}
+        for source in (self.loaded.get(user_id, {}), self.buckets.get(user_id, {})):
+            for (k, key), bucket in source.items():
+                if k == kind:
+                    merged.setdefault(key, RollupBucket(kind, key, bucket.start)).merge(bucket)
+        return list(merged.values())
+
+    def take_dirty(self) -> List[Tuple[str, RollupBucket]]:
+        """Removes and returns changed buckets for persisting."""
+        taken = list(self.dirty)
+        self.dirty.clear()
+        return [(user_id, self.buckets[user_id][(kind, key)]) for user_id, kind, key in taken
+                if (kind, key) in self.buckets.get(user_id, {})]
+
+    def _prune(self, user_id: str, today: datetime):
+        cutoff = today - timedelta(days=self.retention_days)
+        for key in [key for key, b in self.buckets.get(user_id, {}).items() if b.start is not None and b.start < cutoff]:
+            del self.buckets[user_id][key]
+            self.dirty.discard((user_id,) + key)
+        for key in [key for key, b in self.loaded.get(user_id, {}).items() if b.start is not None and b.start < cutoff]:
+            del self.loaded[user_id][key]
+
+def compute_insights(store: RollupStore, user_id: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Insights from the user's day and hour buckets (times are UTC):
+      focus_trend    - focus share over the last 3 days vs the 4 days before
+      peak_time      - hour of day with the highest focus share (at least 5 minutes recorded)
+      fatigue_alert  - fatigue share over the last 24 hours
+    """
+    now = now or datetime.now(timezone.utc)
+    days = store.user_buckets(user_id, "day")
+    hours = store.user_buckets(user_id, "hour")
+    if not days:
+        return {
+            "focus_trend": "stable",
+            "peak_time": None,
+            "fatigue_alert": "Low",
+            "recommendation": "Record a session to get personalised insights.",
+            "recorded_minutes_7d": 0.0,
+        }
+
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    recent = _combine(b for b in days if b.start > today - timedelta(days=3))
+    earlier = _combine(b for b in days if today - timedelta(days=7) < b.start <= today - timedelta(days=3))
+    change = recent.share("focus") - earlier.share("focus")
+    if not earlier.total_seconds or abs(change) < 0.05:
+        focus_trend = "stable"
+    else:
+        focus_trend = "improving" if change > 0 else "declining"
+
+    by_hour_of_day: Dict[int, RollupBucket] = {}
+    for bucket in hours:
+        by_hour_of_day.setdefault(bucket.start.hour, RollupBucket("hour_of_day", str(bucket.start.hour))).merge(bucket)
+    candidates = {h: b.share("focus") for h, b in by_hour_of_day.items() if b.total_seconds >= 300}
+    peak_hour = max(candidates, key=candidates.get) if candidates else None
+
+    last_day = _combine(b for b in hours if b.start > now - timedelta(hours=24))
+    fatigue = last_day.share("fatigue")
+    fatigue_alert = "High" if fatigue > 0.3 else "Moderate" if fatigue > 0.15 else "Low"
+
+    if fatigue_alert == "High":
+        recommendation = "Fatigue is frequent today; take a longer break before your next session."
+    elif peak_hour is not None and focus_trend != "improving":
+        recommendation = f"You focus best around {_format_hour(peak_hour)}; try scheduling sessions then."
+    elif focus_trend == "improving":
+        recommendation = "Try increasing session duration by 5 minutes."
+    else:
+        recommendation = "Keep a regular schedule to build focus."
+
+    week = _combine(b for b in days if b.start > today - timedelta(days=7))
+    return {
+        "focus_trend": focus_trend,
+        "peak_time": _format_hour(peak_hour) if peak_hour is not None else None,
+        "fatigue_alert": fatigue_alert,
+        "recommendation": recommendation,
+        "recorded_minutes_7d": round(week.total_seconds / 60, 1),
+        "focus_share_7d": round(week.share("focus"), 3),
+        "band_means_7d": dict(zip(BAND_NAMES, week.bands.mean.tolist())),
+    }
+
+def _combine(buckets: Iterable[RollupBucket]) -> RollupBucket:
+    combined = RollupBucket("combined", "")
+    for bucket in buckets:
+        combined.merge(bucket)
+    return combined
+
+def _format_hour(hour: int) -> str:
+    return f"{hour % 12 or 12}:00 {'AM' if hour < 12 else 'PM'} UTC"
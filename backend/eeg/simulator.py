@@ -1,55 +1,155 @@
 import numpy as np
-import time
-import random
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Oscillatory components per state: (frequency Hz, amplitude)
+# Delta (0.5-4Hz), Theta (4-8Hz), Alpha (8-13Hz), Beta (13-30Hz), Gamma (30-50Hz)
+STATE_PROFILES: Dict[str, List[Tuple[float, float]]] = {
+    "neutral": [],
+    # High Beta (15-25Hz), Low Alpha
+    "focus":   [(20, 15.0), (10, 5.0)],
+    # High Alpha (8-12Hz), Low Beta
+    "relax":   [(10, 20.0), (20, 3.0)],
+    # High Theta (4-8Hz), Low Alpha
+    "fatigue": [(6, 18.0), (10, 5.0)],
+    # High Gamma (>30Hz), High Beta
+    "stress":  [(40, 10.0), (22, 15.0)],
+}
+SIM_STATES = tuple(STATE_PROFILES)
+
+# Eye blink artifact: high-amplitude delta-like bump
+BLINK_SAMPLES = 50
+BLINK_AMPLITUDE = 100.0
 
 class EEGSimulator:
-    def __init__(self, sample_rate=250):
+    def __init__(self, sample_rate=250, seed: Optional[int] = None):
         self.sample_rate = sample_rate
-        self.phase = 0.0
-        
+        self.rng = np.random.default_rng(seed)
+        # Absolute sample counter, so consecutive packets continue each sine's phase
+        self.sample_index = 0
+
     def generate_packet(self, duration_sec=1.0, state="neutral"):
         """
         Generates a chunk of EEG data based on the requested state.
         States: 'focus' (High Beta), 'relax' (High Alpha), 'fatigue' (High Theta), 'stress' (High Gamma)
+        Consecutive packets are phase-continuous.
         """
         num_samples = int(self.sample_rate * duration_sec)
-        time_steps = np.linspace(0, duration_sec, num_samples, endpoint=False)
-        
+        time_steps = (self.sample_index + np.arange(num_samples)) / self.sample_rate
+        self.sample_index += num_samples
+
         # Base noise (1/f noise approximation)
-        signal = np.random.normal(0, 2.0, num_samples)
-        
+        signal = self.rng.normal(0, 2.0, num_samples)
+
         # Add specific bands based on state
-        # Delta (0.5-4Hz), Theta (4-8Hz), Alpha (8-13Hz), Beta (13-30Hz), Gamma (30-50Hz)
-        
-        # Update phase to keep continuity if streamed (simplified for packet gen)
-        # For a stateless simulator, we might reset phase or pass it in. 
-        # Here we rely on the large time window or just random phases for demo.
-        
-        if state == "focus":
-            # High Beta (15-25Hz), Low Alpha
-            signal += 15.0 * np.sin(2 * np.pi * 20 * time_steps) # Beta
-            signal += 5.0 * np.sin(2 * np.pi * 10 * time_steps)  # Alpha
-            
-        elif state == "relax":
-            # High Alpha (8-12Hz), Low Beta
-            signal += 20.0 * np.sin(2 * np.pi * 10 * time_steps) # Alpha
-            signal += 3.0 * np.sin(2 * np.pi * 20 * time_steps)  # Beta
-            
-        elif state == "fatigue":
-            # High Theta (4-8Hz), Low Alpha
-            signal += 18.0 * np.sin(2 * np.pi * 6 * time_steps)  # Theta
-            signal += 5.0 * np.sin(2 * np.pi * 10 * time_steps)  # Alpha
-            
-        elif state == "stress":
-            # High Gamma (>30Hz), High Beta
-            signal += 10.0 * np.sin(2 * np.pi * 40 * time_steps) # Gamma
-            signal += 15.0 * np.sin(2 * np.pi * 22 * time_steps) # Beta
-        
+        for freq, amplitude in STATE_PROFILES.get(state, []):
+            signal += amplitude * np.sin(2 * np.pi * freq * time_steps)
+
         # Artifacts (Blinks/Jaw clench) - Random injection
-        if num_samples >= 50 and random.random() < 0.05: # 5% chance of artifact
+        if num_samples >= BLINK_SAMPLES and self.rng.random() < 0.05: # 5% chance of artifact
             # Eye blink (high amplitude delta wave)
-            blink_start = random.randint(0, num_samples - 50)
-            blink_window = np.hanning(50) * 100 # High amp
-            signal[blink_start:blink_start+50] += blink_window
+            blink_start = self.rng.integers(0, num_samples - BLINK_SAMPLES + 1)
+            signal[blink_start:blink_start + BLINK_SAMPLES] += np.hanning(BLINK_SAMPLES) * BLINK_AMPLITUDE
 
         return signal
+
+class MultiUserEEGSimulator:
+    """
+    Load-generation simulator: many virtual users x channels in one vectorized call.
+
+    - Phase-continuous: time is an absolute sample counter shared by all users, and each
+      (user, channel, component) has a fixed random phase offset.
+    - Reproducible: every random draw comes from one seeded np.random.Generator.
+    - Per-user state schedules and random blink artifacts.
+
+    Sines are expanded as a*sin(wt + p) = (a*cos p)*sin(wt) + (a*sin p)*cos(wt), so a block
+    is two (users*channels, components) @ (components, samples) products regardless of
+    how many users are simulated.
+    """
+    def __init__(self, users: int, channels: int = 4, sample_rate: int = 250, seed: Optional[int] = None,
+                 artifact_rate: float = 0.05, noise_std: float = 2.0):
+        self.users = users
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.artifact_rate = artifact_rate
+        self.noise_std = noise_std
+        self.rng = np.random.default_rng(seed)
+        self.sample_index = 0
+
+        # Component table shared by all states: frequencies (K,) and amplitudes per state (states, K)
+        self.freqs = np.array(sorted({freq for profile in STATE_PROFILES.values() for freq, _ in profile}), dtype=float)
+        self.amplitudes = np.zeros((len(SIM_STATES), len(self.freqs)))
+        for code, state in enumerate(SIM_STATES):
+            for freq, amplitude in STATE_PROFILES[state]:
+                self.amplitudes[code, np.searchsorted(self.freqs, freq)] += amplitude
+
+        phases = self.rng.uniform(0, 2 * np.pi, (users, channels, len(self.freqs)))
+        self._cos_phase = np.cos(phases)
+        self._sin_phase = np.sin(phases)
+
+        self.states = np.zeros(users, dtype=np.int8)
+        self.schedules: Dict[int, List[Tuple[float, int]]] = {}
+        # Users that received a blink in the most recent block
+        self.last_artifacts = np.zeros(users, dtype=bool)
+
+    @property
+    def time_sec(self) -> float:
+        return self.sample_index / self.sample_rate
+
+    def set_state(self, users, state: str):
+        """Sets the state of one user, a sequence of users, or all users (slice(None))."""
+        self.states[users] = SIM_STATES.index(state)
+
+    def set_schedule(self, user: int, schedule: Sequence[Tuple[float, str]]):
+        """
+        Per-user state timeline as (start_time_sec, state) pairs, e.g. [(0, "relax"), (30, "focus")].
+        The schedule is evaluated at the start of each block.
+        """
+        self.schedules[user] = sorted((start, SIM_STATES.index(state)) for start, state in schedule)
+
+    def generate_block(self, duration_sec: float = 0.1) -> np.ndarray:
+        """Returns a (users, channels, samples) block and advances the shared clock."""
+        num_samples = int(self.sample_rate * duration_sec)
+        self._apply_schedules()
+
+        t = (self.sample_index + np.arange(num_samples)) / self.sample_rate
+        self.sample_index += num_samples
+        omega_t = 2 * np.pi * np.outer(self.freqs, t)
+
+        amps = self.amplitudes[self.states][:, np.newaxis, :]
+        flat = self.users * self.channels
+        signal = (
+            (amps * self._cos_phase).reshape(flat, -1) @ np.sin(omega_t)
+            + (amps * self._sin_phase).reshape(flat, -1) @ np.cos(omega_t)
+        ).reshape(self.users, self.channels, num_samples)
+
+        # Base noise
+        signal += self.rng.normal(0, self.noise_std, signal.shape)
+
+        self._inject_artifacts(signal)
+        return signal
+
+    def _apply_schedules(self):
+        now = self.time_sec
+        for user, schedule in self.schedules.items():
+            for start, code in schedule:
+                if start > now:
+                    break
+                self.states[user] = code
+
+    def _inject_artifacts(self, signal: np.ndarray):
+        """Adds an eye blink (same on every channel) to a random subset of users."""
+        num_samples = signal.shape[-1]
+        self.last_artifacts[:] = False
+        if num_samples < BLINK_SAMPLES or self.artifact_rate <= 0:
+            return
+
+        hit = np.flatnonzero(self.rng.random(self.users) < self.artifact_rate)
+        if len(hit) == 0:
+            return
+        starts = self.rng.integers(0, num_samples - BLINK_SAMPLES + 1, len(hit))
+        sample_idx = starts[:, np.newaxis] + np.arange(BLINK_SAMPLES)
+
+        # (users, samples, channels) view so each hit user's blink window is one fancy-index write
+        by_sample = signal.transpose(0, 2, 1)
+        by_sample[hit[:, np.newaxis], sample_idx] += (np.hanning(BLINK_SAMPLES) * BLINK_AMPLITUDE)[np.newaxis, :, np.newaxis]
+        self.last_artifacts[hit] = True
@@ -0,0 +1,74 @@
+import numpy as np
+from functools import lru_cache
+from typing import Tuple
+
+# Frequency bands (Hz), in the order used for band matrices
+BANDS = {
+    "delta": (0.5, 4),
+    "theta": (4, 8),
+    "alpha": (8, 13),
+    "beta":  (13, 30),
+    "gamma": (30, 50),
+}
+BAND_NAMES = tuple(BANDS)
+BAND_EDGES = tuple(BANDS.values())
+
+class BandPlan:
+    """
+    Precomputed mapping from rFFT bins to band powers for one
+    (sample_rate, window_length, band edges) combination.
+    Band power is the mean magnitude over the bins inside [low, high],
+    so all bands come out of a single (bins x bands) matrix product.
+    """
+    def __init__(self, sample_rate: int, window_length: int, band_edges: Tuple[Tuple[float, float], ...]):
+        self.sample_rate = sample_rate
+        self.window_length = window_length
+        self.band_edges = band_edges
+        self.freqs = np.fft.rfftfreq(window_length, 1/sample_rate)
+
+        # Bands are contiguous bin ranges; keep them as slices for callers that
+        # only need a subset of bins (e.g. incremental trackers)
+        self.slices = []
+        self.weights = np.zeros((len(self.freqs), len(band_edges)))
+        for i, (low, high) in enumerate(band_edges):
+            idx = np.flatnonzero(np.logical_and(self.freqs >= low, self.freqs <= high))
+            if len(idx) == 0:
+                # Band narrower than the bin spacing: its power is reported as 0
+                self.slices.append(slice(0, 0))
+                continue
+            self.slices.append(slice(idx[0], idx[-1] + 1))
+            self.weights[idx, i] = 1.0 / len(idx)
+
+    def band_powers(self, magnitudes: np.ndarray) -> np.ndarray:
+        """(..., bins) magnitudes -> (..., bands) mean magnitude per band."""
+        return magnitudes @ self.weights
+
+@lru_cache(maxsize=32)
+def get_band_plan(sample_rate: int, window_length: int, band_edges: Tuple[Tuple[float, float], ...] = BAND_EDGES) -> BandPlan:
+    """Returns the cached BandPlan for this combination, building it on first use."""
+    return BandPlan(sample_rate, window_length, band_edges)
+
+@lru_cache(maxsize=32)
+def get_hann_window(length: int) -> np.ndarray:
+    """Periodic Hann window (the spectral-analysis variant), cached per length."""
+    window = np.hanning(length + 1)[:-1]
+    window.flags.writeable = False
+    return window
+
+def fft_magnitudes(window: np.ndarray) -> np.ndarray:
+    """Single-periodogram magnitude spectrum of (..., samples), normalized by window length."""
+    return np.abs(np.fft.rfft(window, axis=-1)) / window.shape[-1]
+
+def welch_magnitudes(window: np.ndarray, segment_length: int, overlap: float = 0.5) -> np.ndarray:
+    """
+    Welch estimate over overlapping Hann-windowed segments of (..., samples).
+    Segment power spectra are averaged, then converted back to magnitudes scaled
+    by the window sum so the result is on the same scale as fft_magnitudes.
+    """
+    step = max(1, int(segment_length * (1 - overlap)))
+    segments = np.lib.stride_tricks.sliding_window_view(window, segment_length, axis=-1)[..., ::step, :]
+    hann = get_hann_window(segment_length)
+
+    spectra = np.fft.rfft(segments * hann, axis=-1)
+    power = np.mean(spectra.real ** 2 + spectra.imag ** 2, axis=-2)
+    return np.sqrt(power) / hann.sum()
@@ -0,0 +1,253 @@
+import time
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Set
+from eeg.spectral import BAND_NAMES
+from eeg.ai_engine import STATES, STATE_CODES
+from eeg.rollups import RunningStats
+
+# Change in focus share across a session (from the fitted line) that counts as a trend
+FOCUS_TREND_THRESHOLD = 0.1
+
+class SessionSummary:
+    """
+    Running statistics for one recording session, updated per processed block in O(1) memory:
+    Welford mean/variance per band, seconds per AI state, fatigue episodes, artifact blocks,
+    signal-quality min/mean, and a weighted least-squares line of "in focus" against elapsed
+    time for the focus trend. Nothing is read back from eeg_band_logs to finalize it.
+    """
+    def __init__(self, session_id: str, user_id: str, artifact_threshold: float):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.artifact_threshold = artifact_threshold
+        self.finished = False
+
+        self.bands = RunningStats()
+        self.state_seconds = np.zeros(len(STATES))
+        self.first_state: Optional[int] = None
+        self.last_state: Optional[int] = None
+        self.fatigue_events = 0
+        self.blocks = 0
+        self.artifact_blocks = 0
+        self.quality_min = float("inf")
+        self.quality_sum = 0.0
+
+        self.first_timestamp: Optional[float] = None
+        self.last_timestamp: Optional[float] = None
+        self.updated = time.monotonic()
+        # Duration-weighted sums for the focus-vs-time regression (x in seconds since start)
+        self._w = self._wx = self._wy = self._wxx = self._wxy = 0.0
+
+    def add(self, bands: Dict[str, float], state: str, duration_sec: float, timestamp: float,
+            signal_quality: float, samples: Optional[np.ndarray] = None):
+        values = np.fromiter((bands[name] for name in BAND_NAMES), dtype=float, count=len(BAND_NAMES))
+        code = STATE_CODES.get(state, STATE_CODES["unknown"])
+        self.bands.add(values)
+        self.state_seconds[code] += duration_sec
+        if code == STATE_CODES["fatigue"] and self.last_state != code:
+            self.fatigue_events += 1
+        if self.first_state is None:
+            self.first_state = code
+        self.last_state = code
+
+        self.blocks += 1
+        if samples is not None and samples.size and np.abs(samples).max() > self.artifact_threshold:
+            self.artifact_blocks += 1
+        self.quality_min = min(self.quality_min, signal_quality)
+        self.quality_sum += signal_quality
+
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_timestamp = max(self.last_timestamp or timestamp, timestamp + duration_sec)
+        x = timestamp + duration_sec / 2 - self.first_timestamp
+        y = 1.0 if code == STATE_CODES["focus"] else 0.0
+        self._w += duration_sec
+        self._wx += duration_sec * x
+        self._wy += duration_sec * y
+        self._wxx += duration_sec * x * x
+        self._wxy += duration_sec * x * y
+        self.updated = time.monotonic()
+
+    @property
+    def recorded_seconds(self) -> float:
+        return float(self.state_seconds.sum())
+
+    @property
+    def focus_share(self) -> float:
+        total = self.recorded_seconds
+        return float(self.state_seconds[STATE_CODES["focus"]] / total) if total else 0.0
+
+    @property
+    def focus_trend(self) -> str:
+        """improving / declining if the fitted focus share moves by FOCUS_TREND_THRESHOLD over the session."""
+        denominator = self._w * self._wxx - self._wx ** 2
+        if self.first_timestamp is None or denominator <= 0:
+            return "stable"
+        slope = (self._w * self._wxy - self._wx * self._wy) / denominator
+        change = slope * (self.last_timestamp - self.first_timestamp)
+        if abs(change) < FOCUS_TREND_THRESHOLD:
+            return "stable"
+        return "improving" if change > 0 else "declining"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "duration_sec": round(self.recorded_seconds, 3),
+            "blocks": self.blocks,
+            "band_mean": dict(zip(BAND_NAMES, self.bands.mean.tolist())),
+            "band_std": dict(zip(BAND_NAMES, np.sqrt(self.bands.variance).tolist())),
+            "state_seconds": dict(zip(STATES, np.round(self.state_seconds, 3).tolist())),
+            "fatigue_events": self.fatigue_events,
+            "artifact_blocks": self.artifact_blocks,
+            "signal_quality_min": self.quality_min if self.blocks else None,
+            "signal_quality_avg": self.quality_sum / self.blocks if self.blocks else None,
+        }
+
+    def to_state(self) -> Dict[str, Any]:
+        """Running state as JSON, so a part recorded in another process can be merged (from_state)."""
+        return {
+            "band_count": self.bands.count,
+            "band_mean": self.bands.mean.tolist(),
+            "band_m2": self.bands.m2.tolist(),
+            "state_seconds": self.state_seconds.tolist(),
+            "first_state": self.first_state,
+            "last_state": self.last_state,
+            "fatigue_events": self.fatigue_events,
+            "blocks": self.blocks,
+            "artifact_blocks": self.artifact_blocks,
+            "quality_min": self.quality_min if self.blocks else None,
+            "quality_sum": self.quality_sum,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+            "regression": [self._w, self._wx, self._wy, self._wxx, self._wxy],
+        }
+
+    @classmethod
+    def from_state(cls, session_id: str, user_id: str, artifact_threshold: float,
+                   state: Dict[str, Any]) -> "SessionSummary":
+        summary = cls(session_id, user_id, artifact_threshold)
+        summary.bands.count = int(state["band_count"])
+        summary.bands.mean = np.asarray(state["band_mean"], dtype=float)
+        summary.bands.m2 = np.asarray(state["band_m2"], dtype=float)
+        summary.state_seconds = np.asarray(state["state_seconds"], dtype=float)
+        summary.first_state = state["first_state"]
+        summary.last_state = state["last_state"]
+        summary.fatigue_events = state["fatigue_events"]
+        summary.blocks = state["blocks"]
+        summary.artifact_blocks = state["artifact_blocks"]
+        summary.quality_min = state["quality_min"] if state["quality_min"] is not None else float("inf")
+        summary.quality_sum = state["quality_sum"]
+        summary.first_timestamp = state["first_timestamp"]
+        summary.last_timestamp = state["last_timestamp"]
+        summary._w, summary._wx, summary._wy, summary._wxx, summary._wxy = state["regression"]
+        return summary
+
+    def merge(self, other: "SessionSummary"):
+        """
+        Folds in a part of the same session recorded elsewhere. A fatigue episode running
+        from one part into the next counts once if the parts follow each other in time.
+        """
+        if other.first_timestamp is None:
+            return
+        fatigue = STATE_CODES["fatigue"]
+        if self.first_timestamp is not None:
+            earlier, later = (self, other) if self.first_timestamp <= other.first_timestamp else (other, self)
+            if (earlier.last_timestamp <= later.first_timestamp
+                    and earlier.last_state == fatigue and later.first_state == fatigue):
+                self.fatigue_events -= 1
+        if self.first_timestamp is None:
+            start = other.first_timestamp
+        else:
+            start = min(self.first_timestamp, other.first_timestamp)
+        # Regression sums are relative to each part's first timestamp; shift both to the earliest
+        sums = [0.0] * 5
+        for part in (self, other):
+            if part.first_timestamp is None:
+                continue
+            d = part.first_timestamp - start
+            sums[0] += part._w
+            sums[1] += part._wx + d * part._w
+            sums[2] += part._wy
+            sums[3] += part._wxx + 2 * d * part._wx + d * d * part._w
+            sums[4] += part._wxy + d * part._wy
+        self._w, self._wx, self._wy, self._wxx, self._wxy = sums
+
+        self.bands.merge(other.bands)
+        self.state_seconds = self.state_seconds + other.state_seconds
+        if self.last_timestamp is None or other.last_timestamp > self.last_timestamp:
+            self.last_state = other.last_state
+            self.last_timestamp = other.last_timestamp
+        if self.first_timestamp is None or other.first_timestamp < self.first_timestamp:
+            self.first_state = other.first_state
+        self.first_timestamp = start
+        self.fatigue_events += other.fatigue_events
+        self.blocks += other.blocks
+        self.artifact_blocks += other.artifact_blocks
+        self.quality_min = min(self.quality_min, other.quality_min)
+        self.quality_sum += other.quality_sum
+
+    def session_columns(self) -> Dict[str, Any]:
+        """study_sessions columns written when the session ends."""
+        return {
+            "average_focus": int(round(self.focus_share * 100)),
+            "focus_trend": self.focus_trend,
+            "total_fatigue_events": self.fatigue_events,
+            "summary": self.to_dict(),
+        }
+
+def merge_summaries(summaries: Iterable[SessionSummary]) -> Optional[SessionSummary]:
+    """A new summary combining parts of one session (their first one's ids), or None if there are none."""
+    merged = None
+    for summary in summaries:
+        if merged is None:
+            merged = SessionSummary(summary.session_id, summary.user_id, summary.artifact_threshold)
+        merged.merge(summary)
+    return merged
+
+class SessionSummaryStore:
+    """
+    Live summaries by session id for this process. A finished summary stays as a tombstone,
+    so blocks still arriving after /sessions/end don't start a new one; summaries (finished
+    or abandoned) idle for `idle_sec` are dropped when new sessions start. Sessions changed
+    since the last take_dirty() are tracked for persisting (supabase_client/summaries.py).
+    """
+    def __init__(self, artifact_threshold: float, idle_sec: float):
+        self.artifact_threshold = artifact_threshold
+        self.idle_sec = idle_sec
+        self.sessions: Dict[str, SessionSummary] = {}
+        self.dirty: Set[str] = set()
+
+    def record(self, session_id: str, user_id: str, bands: Dict[str, float], state: str, duration_sec: float,
+               timestamp: float, signal_quality: float, samples: Optional[np.ndarray] = None):
+        summary = self.sessions.get(session_id)
+        if summary is None:
+            self._prune()
+            summary = self.sessions[session_id] = SessionSummary(session_id, user_id, self.artifact_threshold)
+        if summary.finished or summary.user_id != user_id:
+            return
+        summary.add(bands, state, duration_sec, timestamp, signal_quality, samples)
+        self.dirty.add(session_id)
+
+    def take_dirty(self) -> List[SessionSummary]:
+        """Removes and returns the unfinished summaries changed since the last call."""
+        taken = [self.sessions[sid] for sid in self.dirty if sid in self.sessions and not self.sessions[sid].finished]
+        self.dirty.clear()
+        return taken
+
+    def finish(self, session_id: str, user_id: str) -> Optional[SessionSummary]:
+        """Freezes and returns the user's summary for `session_id`, or None if this process has none."""
+        summary = self.sessions.get(session_id)
+        if summary is None or summary.user_id != user_id:
+            return None
+        summary.finished = True
+        summary.updated = time.monotonic()
+        self.dirty.discard(session_id)
+        return summary
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.idle_sec
+        for session_id in [sid for sid, s in self.sessions.items() if s.updated < cutoff]:
+            del self.sessions[session_id]
+            self.dirty.discard(session_id)
+
+    def metrics(self) -> dict:
+        finished = sum(1 for s in self.sessions.values() if s.finished)
+        return {"active": len(self.sessions) - finished, "finished": finished}
@@ -0,0 +1,280 @@
+import asyncio
+import multiprocessing as mp
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Optional, Tuple
+
+from eeg.processor import create_processor
+from eeg.ai_engine import AIEngine
+from eeg.spectral import BAND_NAMES
+
+# Task message kinds sent to workers (small tuples; sample data never goes through the queue)
+TASK_OPEN = 0
+TASK_CLOSE = 1
+TASK_CHUNK = 2
+
+class SharedLayout:
+    """
+    Shapes of the two shared-memory arrays used by the pool:
+      input:  (slots, depth, channels, chunk_samples) float32 ring of raw chunks per session slot
+      output: (slots, depth, channels + 1, bands) float64 band powers (last row = channel average)
+    A chunk with sequence number `seq` lives at ring position seq % depth in both arrays.
+    """
+    def __init__(self, slots: int, depth: int, channels: int, chunk_samples: int):
+        self.slots = slots
+        self.depth = depth
+        self.channels = channels
+        self.chunk_samples = chunk_samples
+        self.input_shape = (slots, depth, channels, chunk_samples)
+        self.output_shape = (slots, depth, channels + 1, len(BAND_NAMES))
+
+    def attach(self, input_name: str, output_name: str):
+        """Opens existing segments and returns (input_shm, output_shm, input_array, output_array)."""
+        input_shm = shared_memory.SharedMemory(name=input_name)
+        output_shm = shared_memory.SharedMemory(name=output_name)
+        inputs = np.ndarray(self.input_shape, dtype=np.float32, buffer=input_shm.buf)
+        outputs = np.ndarray(self.output_shape, dtype=np.float64, buffer=output_shm.buf)
+        return input_shm, output_shm, inputs, outputs
+
+def _worker_main(layout: SharedLayout, input_name: str, output_name: str, tasks, results, processor_options: Dict[str, Any]):
+    """
+    DSP/AI worker process: owns the EEGProcessor and AIEngine for the slots routed to it,
+    reads chunks straight out of shared memory and writes band powers back the same way.
+    Only the (small) AI result dict is sent back through the results queue.
+    """
+    input_shm, output_shm, inputs, outputs = layout.attach(input_name, output_name)
+    ai = AIEngine()
+    processors = {}
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            kind, slot = task[0], task[1]
+
+            if kind == TASK_OPEN:
+                channels, sample_rate = task[2], task[3]
+                processors[slot] = create_processor(sample_rate=sample_rate, channels=channels, **processor_options)
+            elif kind == TASK_CLOSE:
+                processors.pop(slot, None)
+            elif kind == TASK_CHUNK:
+                seq, n_samples = task[2], task[3]
+                position = seq % layout.depth
+                try:
+                    processor = processors[slot]
+                    block = inputs[slot, position, :processor.channels, :n_samples]
+                    result = processor.process_block(block)
+                    out = outputs[slot, position]
+                    out[:processor.channels] = result["per_channel"]
+                    out[processor.channels] = [result["average"][name] for name in BAND_NAMES]
+                    results.put((slot, seq, ai.analyze(result["average"]), None))
+                except Exception as e:
+                    results.put((slot, seq, None, f"{type(e).__name__}: {e}"))
+    finally:
+        del inputs, outputs
+        input_shm.close()
+        output_shm.close()
+
+class WorkerSession:
+    """Handle for one stream session's slot in the pool."""
+    def __init__(self, pool: "DSPWorkerPool", slot: int, channels: int, sample_rate: int, generation: int):
+        self.pool = pool
+        self.slot = slot
+        self.channels = channels
+        self.sample_rate = sample_rate
+        # Generation of the worker process the slot was opened on (see DSPWorkerPool._check_worker)
+        self.generation = generation
+        self.seq = 0
+
+    async def process_block(self, block: np.ndarray) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Runs a (channels, samples) block through this session's worker-side processor and AI engine.
+        Returns (band_result, ai_result) shaped like EEGProcessor.process_block / AIEngine.analyze.
+        """
+        seq = self.seq
+        self.seq += 1
+        return await self.pool._submit(self, seq, block)
+
+    def close(self):
+        self.pool._release(self)
+
+class DSPWorkerPool:
+    """
+    Optional multi-process DSP mode (DSP_WORKERS > 0).
+
+    Stream sessions write raw chunks into a shared-memory ring and post a tiny task tuple;
+    worker processes run EEGProcessor + AIEngine off the event loop and publish band powers
+    back into shared memory. Each slot is pinned to one worker (slot % workers) so its
+    processor state stays in a single process. A worker found dead when a session opens or
+    submits is respawned; its sessions are reopened there (their filter state starts over).
+    """
+    # Seconds to wait for a worker before failing the tick (e.g. a crashed worker)
+    RESULT_TIMEOUT = 2.0
+
+    def __init__(self):
+        self.layout: Optional[SharedLayout] = None
+        self.workers = []
+        self._task_queues = []
+        # Respawn count per worker index
+        self._generations: List[int] = []
+        self.respawns = 0
+        self._results = None
+        self._free_slots = []
+        self._futures: Dict[Tuple[int, int], asyncio.Future] = {}
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self.workers)
+
+    def start(self, workers: int, processor_options: Dict[str, Any], slots: int = 256, depth: int = 4,
+              channels: int = 8, chunk_samples: int = 256):
+        """Allocates the shared segments and spawns the workers. Must be called from the event loop thread."""
+        self.layout = SharedLayout(slots, depth, channels, chunk_samples)
+        input_bytes = int(np.prod(self.layout.input_shape)) * np.dtype(np.float32).itemsize
+        output_bytes = int(np.prod(self.layout.output_shape)) * np.dtype(np.float64).itemsize
+        self._input_shm = shared_memory.SharedMemory(create=True, size=input_bytes)
+        self._output_shm = shared_memory.SharedMemory(create=True, size=output_bytes)
+        self._inputs = np.ndarray(self.layout.input_shape, dtype=np.float32, buffer=self._input_shm.buf)
+        self._outputs = np.ndarray(self.layout.output_shape, dtype=np.float64, buffer=self._output_shm.buf)
+
+        # "spawn" behaves the same on Windows and Linux and avoids forking the event loop
+        self._ctx = mp.get_context("spawn")
+        self._processor_options = processor_options
+        self._results = self._ctx.Queue()
+        for _ in range(workers):
+            tasks, process = self._spawn()
+            self._task_queues.append(tasks)
+            self.workers.append(process)
+            self._generations.append(0)
+
+        self._free_slots = list(range(slots - 1, -1, -1))
+        self._loop = asyncio.get_running_loop()
+        self._reader = threading.Thread(target=self._read_results, name="dsp-worker-results", daemon=True)
+        self._reader.start()
+        print(f"DSP worker pool started: {workers} workers, {slots} slots")
+
+    def stop(self):
+        if not self.running:
+            return
+        for tasks in self._task_queues:
+            tasks.put(None)
+        for process in self.workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._reader.join(timeout=5)
+
+        for future in self._futures.values():
+            if not future.done():
+                future.cancel()
+        self._futures.clear()
+        self.workers = []
+        self._task_queues = []
+        self._generations = []
+
+        del self._inputs, self._outputs
+        self._input_shm.close()
+        self._input_shm.unlink()
+        self._output_shm.close()
+        self._output_shm.unlink()
+
+    def _spawn(self):
+        tasks = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.layout, self._input_shm.name, self._output_shm.name, tasks, self._results,
+                  self._processor_options),
+            daemon=True
+        )
+        process.start()
+        return tasks, process
+
+    def _check_worker(self, index: int) -> int:
+        """Respawns worker `index` if its process has died. Returns its current generation."""
+        process = self.workers[index]
+        if not process.is_alive():
+            print(f"DSP worker {index} died (exit code {process.exitcode}), respawning")
+            self._task_queues[index], self.workers[index] = self._spawn()
+            self._generations[index] += 1
+            self.respawns += 1
+            # Chunks it was processing will never be answered
+            for key in [key for key in self._futures if key[0] % len(self.workers) == index]:
+                future = self._futures.pop(key)
+                if not future.done():
+                    future.set_exception(RuntimeError("DSP worker died"))
+        return self._generations[index]
+
+    def open_session(self, channels: int = 1, sample_rate: int = 250) -> WorkerSession:
+        if not self._free_slots:
+            raise RuntimeError("DSP worker pool is full")
+        if channels > self.layout.channels:
+            raise ValueError(f"Worker pool supports up to {self.layout.channels} channels")
+        slot = self._free_slots.pop()
+        generation = self._check_worker(slot % len(self.workers))
+        self._queue_for(slot).put((TASK_OPEN, slot, channels, sample_rate))
+        return WorkerSession(self, slot, channels, sample_rate, generation)
+
+    def _release(self, session: WorkerSession):
+        if not self.running:
+            return
+        self._queue_for(session.slot).put((TASK_CLOSE, session.slot))
+        for key in [key for key in self._futures if key[0] == session.slot]:
+            self._futures.pop(key).cancel()
+        self._free_slots.append(session.slot)
+
+    def _queue_for(self, slot: int):
+        return self._task_queues[slot % len(self._task_queues)]
+
+    async def _submit(self, session: WorkerSession, seq: int, block: np.ndarray):
+        block = np.asarray(block)
+        n_samples = block.shape[-1]
+        if block.shape[0] != session.channels or n_samples > self.layout.chunk_samples:
+            raise ValueError(f"Block of shape {block.shape} does not fit the worker slot")
+
+        generation = self._check_worker(session.slot % len(self.workers))
+        if generation != session.generation:
+            # Opened on a worker that has since been respawned: open the slot on the new one
+            self._queue_for(session.slot).put((TASK_OPEN, session.slot, session.channels, session.sample_rate))
+            session.generation = generation
+
+        position = seq % self.layout.depth
+        self._inputs[session.slot, position, :session.channels, :n_samples] = block
+
+        future = self._loop.create_future()
+        self._futures[(session.slot, seq)] = future
+        self._queue_for(session.slot).put((TASK_CHUNK, session.slot, seq, n_samples))
+        try:
+            ai_result = await asyncio.wait_for(future, timeout=self.RESULT_TIMEOUT)
+        finally:
+            self._futures.pop((session.slot, seq), None)
+
+        bands = self._outputs[session.slot, position, :session.channels + 1].copy()
+        band_result = {
+            "per_channel": bands[:session.channels],
+            "average": dict(zip(BAND_NAMES, bands[session.channels].tolist()))
+        }
+        return band_result, ai_result
+
+    def _read_results(self):
+        """Background thread: hands worker results back to the event loop."""
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            self._loop.call_soon_threadsafe(self._resolve, *message)
+
+    def _resolve(self, slot: int, seq: int, ai_result, error):
+        future = self._futures.pop((slot, seq), None)
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(RuntimeError(f"DSP worker failed: {error}"))
+        else:
+            future.set_result(ai_result)
+
+worker_pool = DSPWorkerPool()
@@ -0,0 +1,188 @@
+"""
+Load test for /ws/stream.
+
+Opens N concurrent stream connections (ramped), optionally mixes in start_log/stop_log
+commands, and measures:
+  - end-to-end latency (receive time - payload "timestamp")
+  - inter-arrival jitter (deviation from the expected tick period)
+  - dropped ticks (gaps longer than 1.5 periods)
+  - server CPU, from the backend's /metrics endpoint
+Use --binary to negotiate the packed binary stream protocol instead of JSON.
+Prints p50/p95/p99 and writes the full results as JSON.
+
+Example:
+    python load_test_stream.py --clients 200 --ramp 20 --duration 60 --log-rate 0.05 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.request
+
+import numpy as np
+import websockets
+
+from core.stream_protocol import BINARY_SUBPROTOCOL, unpack_frame
+
+class ClientStats:
+    def __init__(self):
+        self.messages = 0
+        self.latencies = []
+        self.intervals = []
+        self.dropped_ticks = 0
+        self.commands_sent = 0
+        self.errors = []
+        self.connected = False
+
+async def run_client(index: int, args, stats: ClientStats, stop_at: float):
+    uri = f"{args.url}?user_id={args.user_prefix}{index}"
+    period = 1.0 / args.expected_hz
+    try:
+        subprotocols = [BINARY_SUBPROTOCOL] if args.binary else None
+        async with websockets.connect(uri, max_size=None, subprotocols=subprotocols) as websocket:
+            stats.connected = True
+            sender = asyncio.create_task(send_commands(websocket, args, stats, stop_at)) if args.log_rate > 0 else None
+            last_arrival = None
+            try:
+                while True:
+                    remaining = stop_at - time.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    arrival = time.perf_counter()
+                    received_at = time.time()
+                    if isinstance(message, bytes):
+                        timestamp = unpack_frame(message)["timestamp"]
+                    else:
+                        data = json.loads(message)
+                        if data.get("type") == "meta":
+                            # Binary-mode change notifications are not ticks
+                            continue
+                        timestamp = data.get("timestamp")
+
+                    stats.messages += 1
+                    if timestamp:
+                        stats.latencies.append(received_at - timestamp)
+                    if last_arrival is not None:
+                        interval = arrival - last_arrival
+                        stats.intervals.append(interval)
+                        if interval > 1.5 * period:
+                            stats.dropped_ticks += int(round(interval / period)) - 1
+                    last_arrival = arrival
+            finally:
+                if sender:
+                    sender.cancel()
+    except Exception as e:
+        stats.errors.append(f"{type(e).__name__}: {e}")
+
+async def send_commands(websocket, args, stats: ClientStats, stop_at: float):
+    """Toggles start_log/stop_log with exponentially distributed gaps (log_rate per second)."""
+    recording = False
+    while time.time() < stop_at:
+        await asyncio.sleep(random.expovariate(args.log_rate))
+        if recording:
+            command = {"action": "stop_log"}
+        else:
+            command = {"action": "start_log", "session_id": args.session_id}
+        await websocket.send(json.dumps(command))
+        recording = not recording
+        stats.commands_sent += 1
+
+def fetch_metrics(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+async def sample_cpu(args, samples: list, stop_at: float):
+    """Polls /metrics once per second and records (wall_time, process_cpu_seconds)."""
+    loop = asyncio.get_running_loop()
+    while time.time() < stop_at:
+        metrics = await loop.run_in_executor(None, fetch_metrics, args.metrics_url)
+        if metrics and "process_cpu_seconds" in metrics:
+            samples.append((time.time(), metrics["process_cpu_seconds"]))
+        await asyncio.sleep(1.0)
+
+def percentiles(values, scale=1000.0):
+    """p50/p95/p99/max in milliseconds."""
+    if not values:
+        return None
+    data = np.asarray(values) * scale
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "max": round(float(data.max()), 3), "count": len(values)}
+
+async def main(args):
+    stop_at = time.time() + args.ramp + args.duration
+    stats = [ClientStats() for _ in range(args.clients)]
+    cpu_samples = []
+
+    cpu_task = asyncio.create_task(sample_cpu(args, cpu_samples, stop_at))
+    tasks = []
+    for i in range(args.clients):
+        tasks.append(asyncio.create_task(run_client(i, args, stats[i], stop_at)))
+        if args.ramp > 0:
+            await asyncio.sleep(args.ramp / args.clients)
+    await asyncio.gather(*tasks)
+    cpu_task.cancel()
+
+    period = 1.0 / args.expected_hz
+    intervals = [x for s in stats for x in s.intervals]
+    jitter = [abs(x - period) for x in intervals]
+    messages = sum(s.messages for s in stats)
+    dropped = sum(s.dropped_ticks for s in stats)
+
+    cpu = None
+    if len(cpu_samples) >= 2:
+        (t0, c0), (t1, c1) = cpu_samples[0], cpu_samples[-1]
+        cpu = {"avg_utilization": round((c1 - c0) / (t1 - t0), 3), "samples": cpu_samples}
+
+    results = {
+        "config": vars(args),
+        "clients_connected": sum(s.connected for s in stats),
+        "messages": messages,
+        "effective_rate_hz": round(messages / max(1, args.clients) / (args.duration + args.ramp / 2), 3),
+        "dropped_ticks": dropped,
+        "drop_ratio": round(dropped / max(1, messages + dropped), 4),
+        "commands_sent": sum(s.commands_sent for s in stats),
+        "latency_ms": percentiles([x for s in stats for x in s.latencies]),
+        "inter_arrival_ms": percentiles(intervals),
+        "jitter_ms": percentiles(jitter),
+        "server_cpu": cpu,
+        "errors": [e for s in stats for e in s.errors][:20],
+    }
+
+    print(f"Clients connected: {results['clients_connected']}/{args.clients}")
+    print(f"Messages: {messages}  effective rate: {results['effective_rate_hz']} Hz/client  dropped ticks: {dropped}")
+    for key in ("latency_ms", "inter_arrival_ms", "jitter_ms"):
+        print(f"{key}: {results[key]}")
+    if cpu:
+        print(f"Server CPU utilization: {cpu['avg_utilization'] * 100:.1f}% of one core")
+    if results["errors"]:
+        print(f"Errors (first {len(results['errors'])}): {results['errors']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the Neurovex /ws/stream endpoint")
+    parser.add_argument("--url", default="ws://localhost:8000/ws/stream")
+    parser.add_argument("--metrics-url", default="http://localhost:8000/metrics")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which connections are opened")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to keep streaming after the ramp")
+    parser.add_argument("--expected-hz", type=float, default=10.0, help="server tick rate")
+    parser.add_argument("--log-rate", type=float, default=0.0, help="start_log/stop_log toggles per second per client")
+    parser.add_argument("--session-id", default="offline_session", help="session_id sent with start_log")
+    parser.add_argument("--user-prefix", default="load_user_")
+    parser.add_argument("--binary", action="store_true", help="negotiate the packed binary stream protocol")
+    parser.add_argument("--output", default="", help="path for machine-readable JSON results")
+    asyncio.run(main(parser.parse_args()))
@@ -1,12 +1,47 @@
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 from core.config import get_settings
-from routers import stream, session, analytics
+from core.websocket import manager
+from core.executor import db_executor
+from core.cache import read_cache
+from eeg.processor import processor_options_from_settings
+from eeg.workers import worker_pool
+from supabase_client.writer import band_log_writer
+from supabase_client.spool import spool_replayer
+from supabase_client.rollups import rollup_sync
+from supabase_client.service import session_summaries, summary_sync
+from routers import stream, ingest, session, analytics
 
 settings = get_settings()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Optional DSP worker processes (see eeg/workers.py)
+    if settings.DSP_WORKERS > 0:
+        worker_pool.start(
+            settings.DSP_WORKERS,
+            processor_options_from_settings(settings),
+            slots=settings.DSP_WORKER_SLOTS
+        )
+    await manager.broker.start()
+    band_log_writer.start()
+    spool_replayer.start()
+    rollup_sync.start()
+    summary_sync.start()
+    yield
+    # Flush queued band logs before the process exits (anything the DB can't take is spooled)
+    await band_log_writer.stop()
+    await spool_replayer.stop()
+    await rollup_sync.stop()
+    await summary_sync.stop()
+    await manager.broker.stop()
+    worker_pool.stop()
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     description="Medical-Grade BCI Backend for Neurovex. Handles EEG processing, safety checks, and data storage."
 )
@@ -18,10 +53,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browsers only let scripts read listed response headers; history paging needs this one
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Register Routers
 app.include_router(stream.router, tags=["Real-time Stream"])
+app.include_router(ingest.router, tags=["Real-time Stream"])
 app.include_router(session.router, prefix="/api/v1", tags=["Sessions"])
 app.include_router(analytics.router, prefix="/api/v1", tags=["Analytics"])
 
@@ -37,6 +75,21 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "neurovex-backend"}
 
+@app.get("/metrics")
+async def metrics():
+    """Process-level counters for load testing (see load_test_stream.py)."""
+    return {
+        "process_cpu_seconds": time.process_time(),
+        **manager.metrics(),
+        "band_log_writer": band_log_writer.metrics(),
+        "db_executor": db_executor.metrics(),
+        "dsp_worker_respawns": worker_pool.respawns,
+        "spool": spool_replayer.metrics(),
+        "read_cache": read_cache.metrics(),
+        "rollups": rollup_sync.metrics(),
+        "session_summaries": {**session_summaries.metrics(), **summary_sync.metrics()},
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,5 +1,8 @@
 from fastapi import APIRouter, Depends
 from core.auth import get_current_user
+from core.cache import read_cache
+from eeg.rollups import compute_insights
+from supabase_client.rollups import rollup_store, rollup_sync
 
 router = APIRouter()
 
@@ -7,10 +10,14 @@ router = APIRouter()
 async def get_insights(user: dict = Depends(get_current_user)):
     """
     Returns AI-generated insights based on recent sessions.
+    Computed from the user's hour/day rollups (eeg/rollups.py), so the cost doesn't grow
+    with recorded history. Cached per user until the next session start/end or READ_CACHE_TTL_SEC.
     """
-    return {
-        "focus_trend": "improving",
-        "peak_time": "10:00 AM",
-        "fatigue_alert": "Low",
-        "recommendation": "Try increasing session duration by 5 minutes."
-    }
+    user_id = user.get("id")
+
+    async def load():
+        # Pulls in rollups persisted before this process started; falls back to memory only
+        await rollup_sync.ensure_loaded(user_id)
+        return compute_insights(rollup_store, user_id)
+
+    return await read_cache.get_or_load(user_id, "insights", load)
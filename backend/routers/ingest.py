@@ -0,0 +1,229 @@
+from collections import deque
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status
+from core.config import get_settings
+from core.websocket import manager
+from core.auth import verify_token
+from core.device_protocol import DeviceBlock, unpack_device_frame, parse_device_message, SEQ_MODULO
+from eeg.processor import create_processor_from_settings
+from eeg.ai_engine import AIEngine
+from eeg.archive import open_archive_from_settings
+from supabase_client.rollups import rollup_store
+from supabase_client.service import session_summaries
+import json
+import time
+import numpy as np
+
+router = APIRouter()
+settings = get_settings()
+ai = AIEngine()
+
+# Clock offset = min over this many recent blocks of (arrival time - device end-of-block time).
+# The minimum tracks the fastest delivery, so network jitter doesn't shift aligned timestamps.
+OFFSET_WINDOW = 50
+
+class IngestSession:
+    """
+    Per-device state for /ws/ingest: sequence/gap tracking, device-to-server clock alignment,
+    and the DSP processor that the device's samples feed.
+    """
+    def __init__(self, user_id: str, device_id: str, sample_rate: int = 250, session_id: Optional[str] = None):
+        self.user_id = user_id
+        self.device_id = device_id
+        self.sample_rate = sample_rate
+        self.channels = 0
+        self.dsp = None
+        # Raw samples are archived under this recording session, if one was given
+        self.session_id = session_id
+        self.archive = None
+
+        self.next_seq: Optional[int] = None
+        self.next_timestamp: Optional[float] = None
+        self.last_sample: Optional[np.ndarray] = None
+        self._offsets = deque(maxlen=OFFSET_WINDOW)
+
+        # Counters reported to the dashboard with every result
+        self.blocks = 0
+        self.gaps = 0
+        self.missing_samples = 0
+        self.late_blocks = 0
+        self.resets = 0
+
+    def handle_text(self, text: str) -> Optional[DeviceBlock]:
+        message = json.loads(text)
+        if message.get("type") == "device_info":
+            device = message.get("device", {})
+            self.sample_rate = int(device.get("sample_rate") or self.sample_rate)
+            print(f"Ingest device {self.device_id} for {self.user_id}: {device}")
+            return None
+        return parse_device_message(message, self.sample_rate)
+
+    def process(self, block: DeviceBlock, received_at: float) -> Optional[Dict[str, Any]]:
+        """Runs one block through gap handling and DSP/AI. Returns the dashboard payload, or None if dropped."""
+        if block.sample_rate != self.sample_rate or block.channels != self.channels or self.dsp is None:
+            self._reset(block.sample_rate, block.channels)
+
+        missing = self._check_sequence(block)
+        if missing is None:
+            self.late_blocks += 1
+            return None
+
+        samples = block.samples
+        if missing > self.dsp.window_length:
+            # Gap longer than the analysis window: nothing in the buffer is worth keeping
+            self.dsp = create_processor_from_settings(settings, channels=self.channels, sample_rate=self.sample_rate)
+            self.resets += 1
+        elif missing > 0:
+            # Hold the last value across the gap so the window stays aligned with device time
+            hold = np.repeat(self.last_sample[:, np.newaxis], missing, axis=1)
+            samples = np.concatenate([hold, samples], axis=1)
+
+        result = self.dsp.process_block(samples)
+        ai_result = ai.analyze(result["average"])
+        if self.archive:
+            # Archive what the device sent; gaps stay visible in the block index timestamps
+            self.archive.append(block.samples, block.timestamp or received_at, ai_result["state"])
+        if self.session_id:
+            duration_sec = block.samples.shape[1] / self.sample_rate
+            timestamp = block.timestamp or received_at
+            rollup_store.record(self.user_id, self.session_id, result["average"], ai_result["state"],
+                                duration_sec, timestamp)
+            # Signal quality: share of this stretch the device actually delivered
+            quality = 100.0 * block.samples.shape[1] / (block.samples.shape[1] + missing)
+            session_summaries.record(self.session_id, self.user_id, result["average"], ai_result["state"],
+                                     duration_sec, timestamp, quality, block.samples)
+        self.last_sample = block.samples[:, -1].astype(float)
+        self.blocks += 1
+
+        return {
+            "type": "device",
+            "device_id": self.device_id,
+            "seq": block.seq,
+            "timestamp": self._align(block, received_at),
+            "signal": block.samples.tolist(),
+            "bands": result["average"],
+            "analysis": ai_result,
+            "status": {
+                "source": "device",
+                "channel_count": self.channels,
+                "sample_rate": self.sample_rate,
+                "blocks": self.blocks,
+                "gaps": self.gaps,
+                "missing_samples": self.missing_samples,
+                "late_blocks": self.late_blocks,
+                "resets": self.resets
+            }
+        }
+
+    def _reset(self, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dsp = create_processor_from_settings(settings, channels=channels, sample_rate=sample_rate)
+        self.close()
+        # Stream named by owner and device, so one user's devices can't write into another's archive
+        self.archive = open_archive_from_settings(settings, self.session_id, f"{self.user_id}-{self.device_id}",
+                                                  channels, sample_rate)
+        self.last_sample = None
+        self.next_seq = None
+        self.next_timestamp = None
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
+            self.archive = None
+
+    def _check_sequence(self, block: DeviceBlock) -> Optional[int]:
+        """
+        Number of samples lost before this block (0 if contiguous), or None for a late or
+        duplicate block. Uses seq when the device sends it, otherwise the timestamps.
+        """
+        block_len = block.samples.shape[1]
+        missing = 0
+        if block.seq is not None and self.next_seq is not None:
+            ahead = (block.seq - self.next_seq) % SEQ_MODULO
+            if ahead >= SEQ_MODULO // 2:
+                return None
+            if ahead:
+                # Prefer the timestamps for the sample count; blocks need not all be the same size
+                if block.timestamp is not None and self.next_timestamp is not None:
+                    missing = max(0, int(round((block.timestamp - self.next_timestamp) * self.sample_rate)))
+                else:
+                    missing = ahead * block_len
+        elif block.timestamp is not None and self.next_timestamp is not None:
+            drift = int(round((block.timestamp - self.next_timestamp) * self.sample_rate))
+            if drift <= -block_len:
+                return None
+            # Up to half a block of slack for devices with jittery timestamps
+            if drift > block_len // 2:
+                missing = drift
+
+        if missing:
+            self.gaps += 1
+            self.missing_samples += missing
+        if block.seq is not None:
+            self.next_seq = (block.seq + 1) % SEQ_MODULO
+        if block.timestamp is not None:
+            self.next_timestamp = block.timestamp + block_len / self.sample_rate
+        return missing
+
+    def _align(self, block: DeviceBlock, received_at: float) -> float:
+        """Timestamp of the block's last sample on the server clock."""
+        if block.timestamp is None:
+            return received_at
+        device_end = block.timestamp + (block.samples.shape[1] - 1) / self.sample_rate
+        self._offsets.append(received_at - device_end)
+        return device_end + min(self._offsets)
+
+@router.websocket("/ws/ingest")
+async def ingest_endpoint(websocket: WebSocket, device_id: str = "device", session_id: Optional[str] = None,
+                          token: Optional[str] = None):
+    """
+    Device ingest endpoint.
+    The device authenticates as its owner with ?token=<access token> (or an Authorization:
+    Bearer header); the connection is refused with 1008 otherwise. Everything it sends is
+    attributed to that user.
+    Accepts sample blocks as JSON text or packed binary frames (see core/device_protocol.py,
+    the format hardware_simulator.py emits), runs them through a per-device EEGProcessor and
+    the AI engine, and broadcasts each result to the user's dashboards (/ws/stream connections,
+    e.g. with ?source=device). Bad messages get an {"type": "error"} reply and are skipped.
+    With ?session_id=... the raw samples are also archived for that recording (eeg/archive.py).
+    """
+    authorization = websocket.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):].strip()
+    try:
+        user_id = (await verify_token(token or ""))["id"]
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    session = IngestSession(user_id, device_id, session_id=session_id)
+    print(f"Ingest connected: {user_id}/{device_id}")
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            received_at = time.time()
+            try:
+                if message.get("bytes") is not None:
+                    block = unpack_device_frame(message["bytes"])
+                else:
+                    block = session.handle_text(message["text"])
+                if block is None:
+                    continue
+                payload = session.process(block, received_at)
+            except (ValueError, KeyError, TypeError) as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            if payload is not None:
+                await manager.broadcast_to_user(user_id, payload)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Ingest error for {user_id}/{device_id}: {e}")
+    finally:
+        session.close()
+        print(f"Ingest disconnected: {user_id}/{device_id} ({session.blocks} blocks, {session.gaps} gaps)")
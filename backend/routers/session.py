@@ -1,12 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Tuple
 from core.auth import get_current_user
+from core.cache import read_cache
 from supabase_client.service import db_service
+from core.executor import db_executor
 from datetime import datetime
+import base64
+import json
+import uuid
 
 router = APIRouter()
 
+# Columns a history client may request with ?fields= (without it, rows come back whole)
+HISTORY_COLUMNS = ("id", "user_id", "start_time", "end_time", "average_focus", "focus_trend", "total_fatigue_events",
+                   "config", "summary")
+MAX_HISTORY_LIMIT = 100
+
 # Pydantic Models for Request/Response
 class SessionStart(BaseModel):
     duration_minutes: Optional[int] = 10
@@ -26,8 +36,9 @@ async def start_session(session_data: SessionStart, user: dict = Depends(get_cur
     user_id = user.get("id")
     # Log to Supabase
     record = await db_service.log_session_start(user_id, session_data.dict())
+    read_cache.invalidate_user(user_id)
     
-    if record:
+    if not record.get("offline"):
          return {
             "session_id": record['id'],
             "status": "recording",
@@ -35,11 +46,12 @@ async def start_session(session_data: SessionStart, user: dict = Depends(get_cur
             "start_time": record['start_time']
         }
     else:
-        # Fallback if DB fails
+        # DB unavailable: the session is spooled locally and uploaded when it's back
         return {
-            "session_id": "offline_session",
+            "session_id": record['id'],
             "status": "offline_recording",
             "user": user_id,
+            "start_time": record['start_time'],
             "error": "Database write failed"
         }
 
@@ -47,25 +59,84 @@ async def start_session(session_data: SessionStart, user: dict = Depends(get_cur
 async def end_session(session_data: SessionEnd, user: dict = Depends(get_current_user)):
     """
     Ends a session.
-    Computes summary metrics and updates the DB record.
+    Finalizes the summary streamed while it recorded and writes it with end_time in one update.
     """
-    # In a full flow, we would update the end_time here via db_service
-    # For now, acknowledgement is sufficient
+    user_id = user.get("id")
+    record = await db_service.log_session_end(user_id, session_data.session_id)
+    read_cache.invalidate_user(user_id)
     return {
         "session_id": session_data.session_id,
         "status": "completed",
-        "saved_to_cloud": True
+        "saved_to_cloud": not record.get("offline"),
+        "end_time": record["end_time"],
+        "average_focus": record.get("average_focus"),
+        "focus_trend": record.get("focus_trend"),
+        "total_fatigue_events": record.get("total_fatigue_events"),
+        "summary": record.get("summary")
     }
 
 @router.get("/sessions/history")
-async def get_session_history(user: dict = Depends(get_current_user)):
+async def get_session_history(
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_HISTORY_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
     """
-    Fetches past sessions for the authenticated user.
+    Fetches past sessions for the authenticated user, newest first.
+    Keyset pagination: pass the X-Next-Cursor header of one page as `cursor` to get the next.
+    `fields` is a comma-separated subset of HISTORY_COLUMNS (default: every column).
+    Pages are cached per user until the next session start/end or READ_CACHE_TTL_SEC.
     """
-    client = db_service.get_client()
-    try:
-        response = client.table("study_sessions").select("*").eq("user_id", user.get("id")).order("start_time", desc=True).limit(10).execute()
-        return response.data
-    except Exception as e:
-        print(f"Error fetching history: {e}")
+    columns = _parse_fields(fields)
+    after = _decode_cursor(cursor) if cursor else None
+    user_id = user.get("id")
+
+    async def load():
+        client = db_service.get_client()
+        # Cursor columns are always selected, then dropped if they weren't asked for
+        select = ",".join(dict.fromkeys(columns + ("start_time", "id"))) if columns else "*"
+        query = client.table("study_sessions").select(select).eq("user_id", user_id)
+        if after:
+            start_time, session_id = after
+            query = query.or_(f'start_time.lt."{start_time}",and(start_time.eq."{start_time}",id.lt.{session_id})')
+        query = query.order("start_time", desc=True).order("id", desc=True).limit(limit + 1)
+        try:
+            result = await db_executor.run(query.execute)
+        except Exception as e:
+            print(f"Error fetching history: {e}")
+            return None
+        rows = result.data
+        next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {
+            "items": [{name: row.get(name) for name in columns} for row in rows[:limit]] if columns else rows[:limit],
+            "next_cursor": next_cursor
+        }
+
+    page = await read_cache.get_or_load(user_id, ("history", limit, cursor, columns), load)
+    if page is None:
         return []
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
+
+def _parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if not fields:
+        return None
+    columns = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in columns if name not in HISTORY_COLUMNS]
+    if unknown or not columns:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}; choose from {list(HISTORY_COLUMNS)}")
+    return columns
+
+def _encode_cursor(row: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row["start_time"], row["id"]]).encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        start_time, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        datetime.fromisoformat(start_time)
+        return start_time, str(uuid.UUID(session_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -1,103 +1,320 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from core.websocket import manager
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from typing import List, Optional, Union
+from core.config import get_settings
+from core.websocket import manager, encode_json, Outgoing
+from core.auth import verify_token
+from core.stream_protocol import select_encoder, Subscription, envelope
 from eeg.simulator import EEGSimulator
-from eeg.processor import EEGProcessor
+from eeg.processor import create_processor_from_settings
+from eeg.batch import BatchedDSPStage
+from eeg.workers import worker_pool
 from eeg.ai_engine import AIEngine
+from eeg.archive import open_archive_from_settings
 from safety.manager import safety_monitor
-from supabase_client.service import db_service
+from supabase_client.service import db_service, session_summaries
+from supabase_client.rollups import rollup_store
 from hardware.bulb import SmartBulb
 from hardware.car import RCCar
 import asyncio
 import json
+import math
 import time
 import random
+import uuid
+import numpy as np
 
 router = APIRouter()
+settings = get_settings()
 
 # Instantiate modules
-simulator = EEGSimulator()
-dsp = EEGProcessor()
+# Simulator and EEG processor hold per-connection signal state, so they are created per session below
 ai = AIEngine()
+dsp_stage = BatchedDSPStage(max_wait=settings.DSP_BATCH_WINDOW_MS / 1000)
 bulb = SmartBulb()
 car = RCCar()
 
-@router.websocket("/ws/stream")
-async def websocket_endpoint(websocket: WebSocket, user_id: str = "demo_user"):
-    """
-    Main WebSocket endpoint.
-    Handles EEG Streaming, AI Analysis, Hardware Control, and Data Logging.
-    """
-    await manager.connect(websocket, user_id)
-    
-    # Recording State
-    recording_session_id = None
-    
-    try:
+class StreamSession:
+    """Per-connection state and tick logic for /ws/stream."""
+    def __init__(self, websocket: WebSocket, user_id: str, encoder, authenticated: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Names this connection's raw archive stream, so concurrent connections never share one
+        self.connection_id = uuid.uuid4().hex[:12]
+        # Whether user_id came from a verified token rather than the query string
+        self.authenticated = authenticated
+        # JSON (default) or packed binary frames, negotiated via subprotocol
+        self.encoder = encoder
+
+        # Per-session DSP state (ring buffer lives and dies with this connection).
+        # In worker mode the processor lives in a DSP worker process instead.
+        self.channel_count = 1
+        self.simulator = EEGSimulator()
+        self.dsp = create_processor_from_settings(settings, channels=self.channel_count)
+        self.worker_session = None
+        if worker_pool.running:
+            try:
+                self.worker_session = worker_pool.open_session(channels=self.channel_count)
+            except RuntimeError as e:
+                # Pool saturated: this connection processes on the event loop instead
+                print(f"{e}; running DSP for {user_id} in-process")
+
+        # Recording State
+        self.recording_session_id = None
+        # Verified owner of the recording (and of its session); nothing is logged without one
+        self.recording_owner: Optional[str] = None
+        # Raw samples of the current recording (eeg/archive.py), kept only for a verified owner
+        self.archive = None
+
+        # Fields, rates and decimation requested by the client (default: everything, full rate)
+        self.subscription = Subscription(settings.STREAM_TICK_HZ)
+        self.tick_index = 0
+        # Device results rendered so far (subscription rates count device blocks, not ticks)
+        self.device_index = 0
+
+        # Ticks dropped because processing fell more than one period behind
+        self.ticks_skipped = 0
+
+    async def handle_command(self, command: dict):
+        if command.get("action") == "start_log":
+            self.recording_session_id = command.get("session_id")
+            self.recording_owner = await self._recording_owner(command.get("token"))
+            if self.recording_owner and not await self._owns_session(self.recording_owner, self.recording_session_id):
+                self.recording_owner = None
+            self.close_archive()
+            if self.recording_owner:
+                self.archive = open_archive_from_settings(settings, self.recording_session_id,
+                                                          f"{self.recording_owner}-{self.connection_id}",
+                                                          self.channel_count, self.dsp.sample_rate)
+            print(f"Session Recording Started: {self.recording_session_id}")
+        elif command.get("action") == "stop_log":
+            self.recording_session_id = None
+            self.recording_owner = None
+            self.close_archive()
+            print("Session Recording Stopped")
+        elif command.get("action") == "marker":
+            if self.archive:
+                self.archive.add_marker(str(command.get("label", "")))
+        elif command.get("action") == "subscribe":
+            self.subscription = Subscription.from_command(command, settings.STREAM_TICK_HZ)
+
+    async def read_commands(self):
+        """Applies client commands as soon as they arrive. Ends with WebSocketDisconnect."""
         while True:
-            # 1. Non-blocking Check for Commands
+            data = await self.websocket.receive_text()
             try:
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=0.01)
-                command = json.loads(data)
-                
-                if command.get("action") == "start_log":
-                    recording_session_id = command.get("session_id")
-                    print(f"Session Recording Started: {recording_session_id}")
-                elif command.get("action") == "stop_log":
-                    recording_session_id = None
-                    print("Session Recording Stopped")
-                    
-            except asyncio.TimeoutError:
-                pass
+                await self.handle_command(json.loads(data))
             except Exception as e:
                 print(f"Command Error: {e}")
 
-            # 2. Simulation Step (10Hz)
-            await asyncio.sleep(0.09) 
-            
-            # Generate & Process Signal
-            current_state = "focus" 
-            raw_chunk = simulator.generate_packet(duration_sec=0.1, state=current_state)
-            band_powers = dsp.process_chunk(raw_chunk)
+    async def _recording_owner(self, token: Optional[str]) -> Optional[str]:
+        """The user a start_log token (or else the connection's own token) identifies, if any."""
+        if token:
+            try:
+                return (await verify_token(token))["id"]
+            except HTTPException:
+                await manager.send_personal_message({"type": "error", "detail": "Invalid recording token"}, self.websocket)
+                return None
+        return self.user_id if self.authenticated else None
+
+    async def _owns_session(self, owner: str, session_id) -> bool:
+        """Whether `session_id` is one of `owner`'s sessions; tells the client if it isn't (or can't be checked)."""
+        try:
+            session_owner = await db_service.session_owner(str(session_id))
+        except Exception as e:
+            print(f"Could not verify recording session {session_id}: {e}")
+            await manager.send_personal_message({"type": "error", "detail": "Could not verify recording session"}, self.websocket)
+            return False
+        if session_owner != owner:
+            await manager.send_personal_message({"type": "error", "detail": "Unknown recording session"}, self.websocket)
+            return False
+        return True
+
+    async def run_ticks(self):
+        """
+        Drift-free tick loop on the monotonic event-loop clock.
+        Deadlines are multiples of the period, so every session ticks on the same grid
+        (which also lets BatchedDSPStage collect them into one batch). If a tick overruns
+        by more than a full period, the missed ticks are skipped rather than burst out.
+        """
+        period = 1.0 / settings.STREAM_TICK_HZ
+        loop = asyncio.get_running_loop()
+        deadline = math.ceil(loop.time() / period) * period
+
+        while True:
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            await self.tick(period)
+
+            deadline += period
+            lag = loop.time() - deadline
+            if lag > period:
+                missed = int(lag // period)
+                self.ticks_skipped += missed
+                deadline += missed * period
+
+    async def tick(self, duration_sec: float):
+        """One simulation step: generate, process, drive hardware, log and send."""
+        # Generate & Process Signal
+        chunk_start = time.time() - duration_sec
+        current_state = "focus"
+        raw_chunk = self.simulator.generate_packet(duration_sec=duration_sec, state=current_state)
+        band_powers = None
+        if self.worker_session:
+            try:
+                band_result, ai_result = await self.worker_session.process_block(raw_chunk.reshape(1, -1))
+                band_powers = band_result["average"]
+            except (RuntimeError, asyncio.TimeoutError) as e:
+                # Worker died or hung mid-block: this connection processes on the event loop from now on
+                print(f"DSP worker failed ({e!r}); running DSP for {self.user_id} in-process")
+                self.worker_session.close()
+                self.worker_session = None
+        if band_powers is None:
+            if settings.DSP_BATCHING_ENABLED:
+                band_powers = await dsp_stage.process_chunk(self.dsp, raw_chunk)
+            else:
+                band_powers = self.dsp.process_chunk(raw_chunk)
             ai_result = ai.analyze(band_powers)
-            is_safe = safety_monitor.validate_signal(signal_quality=95.0)
-            
-            # 3. Hardware Control Logic (Backend Decision)
-            focus_val = int(ai_result["confidence"] * 100) if ai_result["state"] == "focus" else 30
-            
-            # Bulb Logic
-            bulb.set_brightness(focus_val)
-            bulb.set_color_from_state(ai_result["state"])
-            
-            # Car Logic (Mock Random Direction if focused)
-            car_cmd = "stop"
-            if focus_val > 60:
-                car_cmd = random.choice(["forward", "left", "right"])
-            car.drive(focus_val, car_cmd)
-
-            # 4. Log to DB if Recording
-            if recording_session_id:
-                await db_service.log_eeg_packet(recording_session_id, band_powers, 95.0)
-            
-            # 5. Send Payload
-            payload = {
-                "timestamp": time.time(),
-                "signal": raw_chunk.tolist(),
-                "bands": band_powers,
-                "analysis": ai_result,
-                "hardware": {
+        is_safe = safety_monitor.validate_signal(signal_quality=95.0)
+
+        # Hardware Control Logic (Backend Decision)
+        focus_val = int(ai_result["confidence"] * 100) if ai_result["state"] == "focus" else 30
+
+        # Bulb Logic
+        bulb.set_brightness(focus_val)
+        bulb.set_color_from_state(ai_result["state"])
+
+        # Car Logic (Mock Random Direction if focused)
+        car_cmd = "stop"
+        if focus_val > 60:
+            car_cmd = random.choice(["forward", "left", "right"])
+        car.drive(focus_val, car_cmd)
+
+        # Log to DB if Recording, only for a verified owner's own session; keyed by the owner,
+        # the same id /sessions/end finalizes the summary under
+        if self.recording_session_id and self.recording_owner:
+            await db_service.log_eeg_packet(self.recording_session_id, band_powers, 95.0)
+            rollup_store.record(self.recording_owner, self.recording_session_id, band_powers, ai_result["state"],
+                                duration_sec, chunk_start)
+            session_summaries.record(self.recording_session_id, self.recording_owner, band_powers,
+                                     ai_result["state"], duration_sec, chunk_start, 95.0, raw_chunk)
+        if self.archive:
+            self.archive.append(raw_chunk.reshape(self.channel_count, -1), chunk_start, ai_result["state"])
+
+        # Send Payload: only the fields due for this client on this tick are built and encoded.
+        # DSP/AI above always run, since they drive the hardware and recording.
+        fields = {}
+        for name in self.subscription.due(self.tick_index):
+            if name == "signal":
+                decimate = self.subscription.decimate
+                fields["signal"] = envelope(raw_chunk, decimate) if decimate > 1 else raw_chunk
+            elif name == "bands":
+                fields["bands"] = band_powers
+            elif name == "analysis":
+                fields["analysis"] = ai_result
+            elif name == "hardware":
+                fields["hardware"] = {
                     "bulb": bulb.get_status(),
                     "car": car.get_status()
-                },
-                "status": {
+                }
+            elif name == "status":
+                fields["status"] = {
                     "connected": True,
-                    "recording": bool(recording_session_id),
+                    "recording": bool(self.recording_session_id),
                     "safety_lock": not is_safe,
-                    "channel_count": 1
+                    "channel_count": self.channel_count
                 }
-            }
-            
-            await manager.send_personal_message(payload, websocket)
-            
+        self.tick_index += 1
+
+        messages = self.encoder.encode(time.time(), fields)
+        for message in messages:
+            if isinstance(message, bytes):
+                await manager.send_personal_bytes(message, self.websocket)
+            elif message.get("type") == "meta":
+                await manager.send_personal_meta(message, self.websocket)
+            else:
+                await manager.send_personal_message(message, self.websocket)
+
+    def render_device(self, payload: dict) -> List[Union[Outgoing, dict]]:
+        """
+        A device result from /ws/ingest, reduced to this client's subscription and encoded for
+        it. Meta frames stay dicts, so the writer can coalesce them instead of queueing.
+        """
+        fields = {}
+        for name in self.subscription.due(self.device_index):
+            if name == "signal":
+                signal = np.asarray(payload["signal"], dtype=np.float32)
+                decimate = self.subscription.decimate
+                fields["signal"] = envelope(signal, decimate) if decimate > 1 else signal
+            elif name in payload:
+                fields[name] = payload[name]
+        self.device_index += 1
+
+        messages = []
+        for message in self.encoder.encode(payload["timestamp"], fields):
+            if isinstance(message, dict) and message.get("type") != "meta":
+                message = encode_json({"type": "device", "device_id": payload["device_id"], "seq": payload["seq"],
+                                       **message})
+            messages.append(message)
+        return messages
+
+    def close_archive(self):
+        if self.archive:
+            self.archive.close()
+            self.archive = None
+
+    def close(self):
+        self.close_archive()
+        if self.worker_session:
+            self.worker_session.close()
+
+@router.websocket("/ws/stream")
+async def websocket_endpoint(websocket: WebSocket, user_id: str = "demo_user", source: str = "simulator",
+                             token: Optional[str] = None):
+    """
+    Main WebSocket endpoint.
+    Handles EEG Streaming, AI Analysis, Hardware Control, and Data Logging.
+    Commands are read by their own task, concurrently with the tick loop.
+    Clients offering the "neurovex.bin.v1" subprotocol get packed binary frames
+    (see core/stream_protocol.py); everyone else gets the JSON payload.
+    With source=device the simulated ticks are off and the connection only receives
+    {"type": "device", ...} results from the user's devices on /ws/ingest, encoded and
+    filtered like the ticks. Device results go to the user a token identifies, so a
+    dashboard connects with ?token=<access token> to receive them.
+    """
+    if token:
+        try:
+            user_id = (await verify_token(token))["id"]
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+    encoder = select_encoder(websocket.scope.get("subprotocols", []))
+    try:
+        session = StreamSession(websocket, user_id, encoder, authenticated=bool(token))
+    except Exception as e:
+        print(f"Stream setup failed for {user_id}: {e}")
+        await websocket.accept(subprotocol=encoder.subprotocol)
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    tasks = set()
+    try:
+        await manager.connect(websocket, user_id, subprotocol=encoder.subprotocol, render=session.render_device)
+        tasks.add(asyncio.create_task(session.read_commands()))
+        if source != "device":
+            tasks.add(asyncio.create_task(session.run_ticks()))
+        # Whichever task ends first (normally the reader, on disconnect) ends the session
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
     except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
         print(f"User {user_id} disconnected")
+    except Exception as e:
+        print(f"Stream error for {user_id}: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        manager.disconnect(websocket, user_id)
+        session.close()
@@ -0,0 +1,23 @@
+from postgrest.exceptions import APIError
+
+# SQLSTATE classes the DB returns for rows it will never accept as sent:
+# 22 data exception (e.g. 22P02 invalid uuid), 23 integrity constraint (e.g. 23503 foreign key),
+# 42 syntax/access rule (e.g. 42501 row-level security, 42703 unknown column)
+PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+
+def is_permanent_error(error: Exception) -> bool:
+    """
+    True if retrying the same write can't succeed: a PostgREST rejection of the request or its
+    rows. Network errors, timeouts, executor backpressure and 5xx/408/429 responses are transient.
+    """
+    if not isinstance(error, APIError):
+        return False
+    code = error.code
+    if isinstance(code, int) or (isinstance(code, str) and code.isdigit() and len(code) == 3):
+        # No PostgREST JSON body, just the HTTP status
+        status = int(code)
+        return 400 <= status < 500 and status not in (408, 429)
+    if isinstance(code, str):
+        # PGRST1xx are request errors, PGRST2xx schema errors (e.g. unknown column)
+        return code[:2] in PERMANENT_SQLSTATE_CLASSES or code.startswith(("PGRST1", "PGRST2"))
+    return False
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+from core.config import get_settings
+from core.auth import get_supabase
+from core.executor import db_executor
+from supabase_client.errors import is_permanent_error
+from eeg.rollups import RollupStore, RollupBucket
+
+# Identifies this process's band_rollups rows; new on every start, so a restarted (or reused)
+# pid never overwrites the rows an earlier process wrote
+WRITER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+class RollupSync:
+    """
+    Persists RollupStore buckets to the band_rollups table and loads them back for insights.
+
+    Every process (uvicorn worker, or a run before a restart) writes only the buckets it
+    recorded itself, under its own WRITER_ID, so concurrent writers never overwrite each
+    other; reads combine all writers' rows for a bucket with Chan's merge. Other writers'
+    rows are reloaded at most every `interval` seconds per user.
+    Each user's buckets are written separately, so rows the DB rejects for one user (e.g. a
+    non-uuid id) are dropped without holding back anyone else's. Users idle for `idle_sec`
+    are evicted from memory once persisted and reloaded on their next insights request.
+    """
+    def __init__(self, store: RollupStore, interval: float, idle_sec: float):
+        self.store = store
+        self.interval = interval
+        self.idle_sec = idle_sec
+        # Monotonic time each user's other-writer rows were last loaded
+        self.loaded: Dict[str, float] = {}
+        self._task = None
+
+        # Metrics
+        self.buckets_written = 0
+        self.buckets_rejected = 0
+        self.users_evicted = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.sync()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sync()
+
+    async def sync(self):
+        by_user = {}
+        for user_id, bucket in self.store.take_dirty():
+            by_user.setdefault(user_id, []).append(bucket)
+
+        pending = list(by_user.items())
+        while pending:
+            user_id, buckets = pending.pop(0)
+            rows = [{**bucket.to_row(user_id), "writer_id": WRITER_ID} for bucket in buckets]
+            try:
+                await db_executor.run(_upsert_rollups, rows)
+                self.buckets_written += len(rows)
+            except Exception as e:
+                if is_permanent_error(e):
+                    self.buckets_rejected += len(rows)
+                    print(f"Rollups for {user_id} rejected by the DB, not persisting them: {e}")
+                    continue
+                self.failures += 1
+                print(f"Error persisting rollups: {e}")
+                # DB unavailable: keep this and every remaining user dirty for the next round
+                for user, user_buckets in [(user_id, buckets)] + pending:
+                    self.store.dirty.update((user, bucket.kind, bucket.key) for bucket in user_buckets)
+                break
+
+        self.store.prune()
+        evicted = self.store.evict_idle(self.idle_sec)
+        for user_id in evicted:
+            self.loaded.pop(user_id, None)
+        self.users_evicted += len(evicted)
+
+    async def ensure_loaded(self, user_id: str) -> bool:
+        """Loads other writers' rows for the user unless they were loaded in the last `interval`."""
+        loaded_at = self.loaded.get(user_id)
+        if loaded_at is not None and time.monotonic() - loaded_at < self.interval:
+            self.store.touch(user_id)
+            return True
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.store.retention_days)
+        try:
+            rows = await db_executor.run(_select_rollups, user_id, cutoff.isoformat())
+        except Exception as e:
+            print(f"Error loading rollups for {user_id}: {e}")
+            if not is_permanent_error(e):
+                # Keep serving the last load, if any
+                self.store.touch(user_id)
+                return loaded_at is not None
+            # The DB will never have rows for this id; count it as loaded (memory only)
+            rows = []
+        self.store.set_loaded(user_id, (RollupBucket.from_row(row) for row in rows))
+        self.loaded[user_id] = time.monotonic()
+        return True
+
+    def metrics(self) -> dict:
+        return {
+            "users": len(self.store.buckets),
+            "loaded_users": len(self.loaded),
+            "dirty_buckets": len(self.store.dirty),
+            "buckets_written": self.buckets_written,
+            "buckets_rejected": self.buckets_rejected,
+            "users_evicted": self.users_evicted,
+            "failures": self.failures,
+        }
+
+def _upsert_rollups(rows):
+    get_supabase().table("band_rollups").upsert(rows, on_conflict="user_id,bucket_kind,bucket_key,writer_id").execute()
+
+def _select_rollups(user_id: str, cutoff: str):
+    """The user's rows from every writer but this process (its own buckets are already in memory)."""
+    return (get_supabase().table("band_rollups").select("*").eq("user_id", user_id)
+            .neq("writer_id", WRITER_ID).gte("bucket_start", cutoff).execute().data)
+
+settings = get_settings()
+rollup_store = RollupStore(retention_days=settings.ROLLUP_RETENTION_DAYS)
+rollup_sync = RollupSync(rollup_store, interval=settings.ROLLUP_FLUSH_INTERVAL_SEC,
+                         idle_sec=settings.ROLLUP_IDLE_EVICT_SEC)
@@ -2,6 +2,8 @@
 create extension if not exists "uuid-ossp";
 
 -- 1. Study Sessions Table
+-- The backend generates id itself, so sessions started offline keep their id when the
+-- local spool replays them (upserts on id ignore rows that already exist)
 create table public.study_sessions (
   id uuid default uuid_generate_v4() primary key,
   user_id uuid references auth.users(id) not null,
@@ -10,12 +12,17 @@ create table public.study_sessions (
   average_focus integer,
   focus_trend text check (focus_trend in ('improving', 'stable', 'declining')),
   total_fatigue_events integer default 0,
-  config jsonb -- Store session configuration
+  config jsonb, -- Store session configuration
+  summary jsonb -- band mean/std, state seconds, artifacts, signal quality; written by /sessions/end
 );
 
+-- Existing databases:
+--   alter table public.study_sessions add column if not exists summary jsonb;
+
 -- 2. EEG Band Logs (Time-series data)
 create table public.eeg_band_logs (
   id bigint generated always as identity primary key,
+  client_id uuid unique, -- idempotency key set by the backend; retries and spool replays upsert on it
   session_id uuid references public.study_sessions(id) not null,
   timestamp timestamptz default now(),
   delta float,
@@ -26,6 +33,9 @@ create table public.eeg_band_logs (
   signal_quality float
 );
 
+-- Existing databases:
+--   alter table public.eeg_band_logs add column if not exists client_id uuid unique;
+
 -- 3. AI Insights
 create table public.ai_insights (
   id uuid default uuid_generate_v4() primary key,
@@ -56,12 +66,46 @@ create table public.user_annotations (
   created_at timestamptz default now()
 );
 
+-- 6. Band Rollups (incremental aggregates behind /analytics/insights)
+-- One row per user, session / UTC hour / UTC day bucket and writer. band_mean and band_m2 are the
+-- Welford mean and sum of squared deviations per band (delta..gamma), so buckets can be merged
+-- without reading eeg_band_logs; state_seconds is time spent in each AI state. Each backend
+-- process writes only what it recorded, under its own writer_id; readers merge a bucket's rows.
+create table public.band_rollups (
+  user_id uuid references auth.users(id) not null,
+  bucket_kind text check (bucket_kind in ('session', 'hour', 'day')) not null,
+  bucket_key text not null, -- session id, hour or date (ISO)
+  writer_id text not null, -- backend process (host-pid-random), new on every start
+  bucket_start timestamptz,
+  sample_count bigint default 0,
+  band_mean float8[],
+  band_m2 float8[],
+  state_seconds jsonb,
+  updated_at timestamptz default now(),
+  primary key (user_id, bucket_kind, bucket_key, writer_id)
+);
+
+-- 7. Session Summary Parts (running /sessions/end summaries, one per session and backend process)
+-- state is eeg/summary.py SessionSummary.to_state(); the process ending a session merges every
+-- process's part, then deletes them. No foreign key to study_sessions: a session started while
+-- the DB was down is spooled, and its parts may arrive before its row.
+create table public.session_summary_parts (
+  session_id uuid not null,
+  writer_id text not null, -- backend process, as in band_rollups
+  user_id uuid references auth.users(id) not null,
+  state jsonb not null,
+  updated_at timestamptz default now(),
+  primary key (session_id, writer_id)
+);
+
 -- Row Level Security (RLS)
 alter table public.study_sessions enable row level security;
 alter table public.eeg_band_logs enable row level security;
 alter table public.ai_insights enable row level security;
 alter table public.hardware_logs enable row level security;
 alter table public.user_annotations enable row level security;
+alter table public.band_rollups enable row level security;
+alter table public.session_summary_parts enable row level security;
 
 -- Policies (Users can only see their own data)
 create policy "Users can view own sessions" on public.study_sessions
@@ -73,6 +117,20 @@ create policy "Users can insert own sessions" on public.study_sessions
 create policy "Users can update own sessions" on public.study_sessions
   for update using (auth.uid() = user_id);
 
+-- The backend maintains rollups; its SUPABASE_KEY must be the service-role key (which bypasses
+-- RLS) or a key acting as the owning user for these to allow the writes
+create policy "Users can view own rollups" on public.band_rollups
+  for select using (auth.uid() = user_id);
+
+create policy "Users can insert own rollups" on public.band_rollups
+  for insert with check (auth.uid() = user_id);
+
+create policy "Users can update own rollups" on public.band_rollups
+  for update using (auth.uid() = user_id);
+
+create policy "Users can manage own summary parts" on public.session_summary_parts
+  for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
+
 -- EEG Logs Policy (Cascade via session ownership)
 create policy "Users can view own eeg logs" on public.eeg_band_logs
   for select using (
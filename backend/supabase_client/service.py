@@ -1,6 +1,19 @@
 from supabase import Client
 from core.config import get_settings
 from core.auth import get_supabase
+from core.executor import db_executor
+from supabase_client.writer import band_log_writer
+from supabase_client.spool import spool, update_session
+from supabase_client.errors import is_permanent_error
+from supabase_client.summaries import SummarySync
+from eeg.summary import SessionSummaryStore, merge_summaries
+from typing import Dict, Optional
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Sessions started while the DB was unreachable that this process remembers the owner of
+MAX_OFFLINE_SESSIONS = 1000
 
 class SupabaseService:
     def __init__(self):
@@ -9,32 +22,94 @@ class SupabaseService:
         # but here we use the client which might be passed in or instantiated.
         # For server-side logging (bypassing RLS or using admin rights), we'd need the SERVICE_ROLE_KEY.
         # For now, we'll assume we are logging on behalf of the user or system.
-        pass
+        # {session_id: user_id} of sessions this process spooled, whose rows aren't in the DB yet
+        self.offline_sessions: Dict[str, str] = {}
 
     def get_client(self) -> Client:
         return get_supabase()
 
     async def log_session_start(self, user_id: str, config: dict):
-        client = self.get_client()
+        """
+        Creates the study_sessions row. The id is generated here, so a session started while
+        the DB is unreachable keeps the same id when the spool replays it later.
+        Returns the row, with "offline": True if it was spooled instead of written.
+        """
         data = {
+            "id": str(uuid.uuid4()),
             "user_id": user_id,
-            "start_time": "now()",
+            "start_time": datetime.now(timezone.utc).isoformat(),
             "config": config,
             "focus_trend": "stable"
         }
-        # In a real async context, we might use the async client or run in executor
-        # supabase-py is synchronous by default for now
+        # supabase-py is synchronous; run it on the bounded DB executor
         try:
-            response = client.table("study_sessions").insert(data).execute()
-            return response.data[0] if response.data else None
+            client = self.get_client()
+            response = await db_executor.run(client.table("study_sessions").insert(data).execute)
+            if response.data:
+                return response.data[0]
         except Exception as e:
-            print(f"Error logging session start: {e}")
-            return None
+            print(f"Error logging session start, spooling locally: {e}")
+        spool.append_session(data)
+        if len(self.offline_sessions) >= MAX_OFFLINE_SESSIONS:
+            del self.offline_sessions[next(iter(self.offline_sessions))]
+        self.offline_sessions[data["id"]] = user_id
+        return {**data, "offline": True}
 
-    async def log_eeg_packet(self, session_id: str, bands: dict, signal_quality: float):
+    async def session_owner(self, session_id: str) -> Optional[str]:
+        """
+        user_id of the session, from the DB or from this process's spooled starts.
+        None if there is no such session; raises if the DB can't be asked.
+        """
+        if session_id in self.offline_sessions:
+            return self.offline_sessions[session_id]
         client = self.get_client()
+        try:
+            response = await db_executor.run(
+                client.table("study_sessions").select("user_id").eq("id", session_id).limit(1).execute)
+        except Exception as e:
+            if is_permanent_error(e):
+                # e.g. not a uuid: no such session
+                return None
+            raise
+        return response.data[0]["user_id"] if response.data else None
+
+    async def log_session_end(self, user_id: str, session_id: str):
+        """
+        Writes end_time and the session's streamed summary (eeg/summary.py) in one update.
+        The summary merges what this process recorded with the parts other processes
+        persisted (supabase_client/summaries.py); without any only end_time is set. Returns the
+        written fields, with "offline": True if they were spooled (DB unavailable, or the session
+        row isn't there yet because its start is still spooled).
+        """
+        summary = session_summaries.finish(session_id, user_id)
+        if self.offline_sessions.get(session_id) == user_id:
+            del self.offline_sessions[session_id]
+        try:
+            parts = await summary_sync.load_parts(session_id, user_id)
+        except Exception as e:
+            print(f"Error loading summary parts of session {session_id}, using this process's only: {e}")
+            parts = []
+        summary = merge_summaries(([summary] if summary is not None else []) + parts)
+        fields = {"end_time": datetime.now(timezone.utc).isoformat()}
+        if summary is not None:
+            fields.update(summary.session_columns())
+        try:
+            if await db_executor.run(update_session, session_id, user_id, fields):
+                if parts:
+                    await summary_sync.delete_parts(session_id)
+                return fields
+            print(f"Session {session_id} not in the DB yet, spooling its end")
+        except Exception as e:
+            print(f"Error logging session end, spooling locally: {e}")
+        spool.append_session_end(session_id, user_id, fields)
+        return {**fields, "offline": True}
+
+    async def log_eeg_packet(self, session_id: str, bands: dict, signal_quality: float):
         data = {
+            # Idempotency key for retries and spool replay
+            "client_id": str(uuid.uuid4()),
             "session_id": session_id,
+            "timestamp_unix": time.time(),
             "delta": bands.get("delta"),
             "theta": bands.get("theta"),
             "alpha": bands.get("alpha"),
@@ -42,11 +117,12 @@ class SupabaseService:
             "gamma": bands.get("gamma"),
             "signal_quality": signal_quality
         }
-        try:
-            # Fire and forget / batching would be better for performance
-            client.table("eeg_band_logs").insert(data).execute()
-        except Exception as e:
-            # Don't crash on log error
-            print(f"Error logging packet: {e}")
+        # Queued for the background bulk writer; never blocks the stream loop
+        band_log_writer.enqueue(data)
 
+settings = get_settings()
+# Live per-session summaries, fed by the stream and ingest loops while a session records
+session_summaries = SessionSummaryStore(artifact_threshold=settings.ARTIFACT_AMPLITUDE_UV,
+                                        idle_sec=settings.SESSION_SUMMARY_IDLE_SEC)
+summary_sync = SummarySync(session_summaries, interval=settings.SESSION_SUMMARY_FLUSH_INTERVAL_SEC)
 db_service = SupabaseService()
@@ -0,0 +1,411 @@
+import asyncio
+import json
+import math
+import os
+import struct
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+from core.config import get_settings
+from core.auth import get_supabase
+from core.executor import db_executor
+from supabase_client.errors import is_permanent_error
+
+try:
+    import fcntl
+except ImportError:  # Windows: no segment locks, so only one process may use a spool directory
+    fcntl = None
+
+# Record layout (little-endian): RECORD_HEADER (payload length, CRC32 of kind + payload, kind) + payload.
+# A torn or corrupt record at the end of a segment (crash mid-append) ends replay of that segment.
+RECORD_HEADER = struct.Struct("<IIB")
+KIND_SESSION = 1  # payload: study_sessions row as JSON
+KIND_BAND_LOG = 2  # payload: BAND_LOG_RECORD + session_id (UTF-8)
+KIND_SESSION_END = 3  # payload: {"id", "user_id", "fields", "attempts"} as JSON, applied as an update
+# Replays of a session end whose row isn't there yet (its start may sit in another worker's
+# newer segment) before it is dead-lettered; each is re-spooled for the next round
+MAX_SESSION_END_ATTEMPTS = 10
+
+# client_id (UUID bytes), timestamp (unix s), delta, theta, alpha, beta, gamma, signal_quality
+# (NaN = null), session_id length
+BAND_LOG_RECORD = struct.Struct("<16sd6dH")
+BAND_FIELDS = ("delta", "theta", "alpha", "beta", "gamma", "signal_quality")
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+# Rows the DB rejected permanently, one JSON object per line: {"table", "rows", "error", "failed_at"}
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+def encode_band_log(row: dict) -> bytes:
+    session = str(row["session_id"]).encode()
+    values = [row.get(name) for name in BAND_FIELDS]
+    return BAND_LOG_RECORD.pack(
+        uuid.UUID(row["client_id"]).bytes,
+        row["timestamp_unix"],
+        *[math.nan if value is None else float(value) for value in values],
+        len(session)
+    ) + session
+
+def decode_band_log(payload: bytes) -> dict:
+    client_id, timestamp, *values, session_len = BAND_LOG_RECORD.unpack_from(payload)
+    session = payload[BAND_LOG_RECORD.size:BAND_LOG_RECORD.size + session_len].decode()
+    row = {"client_id": str(uuid.UUID(bytes=client_id)), "session_id": session, "timestamp_unix": timestamp}
+    row.update({name: None if math.isnan(value) else value for name, value in zip(BAND_FIELDS, values)})
+    return row
+
+class Spool:
+    """
+    Append-only local write-ahead log for DB writes that failed or couldn't keep up.
+
+    Records go to the active segment file; it is closed and a new one started once it
+    passes `segment_bytes`. Closed segments are replayed in order and deleted once uploaded.
+    fsync policy: "always" (after every append call), "interval" (at most every `fsync_interval`
+    seconds, plus on rotation) or "never" (leave it to the OS).
+
+    Several processes (uvicorn workers) can share one directory: each segment is exclusively
+    locked by the process writing it and by whichever replayer is uploading it.
+    """
+    def __init__(self, directory: str, segment_bytes: int, fsync: str = "interval", fsync_interval: float = 1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}', expected one of {FSYNC_POLICIES}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+
+        self._file = None
+        self._active_number = 0
+        self._last_fsync = 0.0
+
+        # Metrics
+        self.records_written = 0
+        self.bytes_written = 0
+
+    def append_session(self, row: dict):
+        self._append(KIND_SESSION, [json.dumps(row).encode()])
+
+    def append_session_end(self, session_id: str, user_id: str, fields: dict, attempts: int = 0):
+        end = {"id": session_id, "user_id": user_id, "fields": fields, "attempts": attempts}
+        self._append(KIND_SESSION_END, [json.dumps(end).encode()])
+
+    def append_band_logs(self, rows: List[dict]):
+        self._append(KIND_BAND_LOG, [encode_band_log(row) for row in rows])
+
+    def _append(self, kind: int, payloads: List[bytes]):
+        """Writes all records, then syncs once per the fsync policy (rotation syncs the full segment)."""
+        for payload in payloads:
+            if self._file is None:
+                self._open_next()
+            record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload, kind), kind) + payload
+            self._file.write(record)
+            self.records_written += 1
+            self.bytes_written += len(record)
+            if self._file.tell() >= self.segment_bytes:
+                self.rotate()
+
+        if self._file is None:
+            return
+        if self.fsync == "always":
+            self._sync()
+        elif self.fsync == "interval" and time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _open_next(self):
+        os.makedirs(self.directory, exist_ok=True)
+        number = max(self._segment_numbers(), default=0) + 1
+        if fcntl is None:
+            # No locks (Windows), and an open file can't be removed there: create the segment
+            # directly, exclusively, taking the next free number
+            while True:
+                try:
+                    f = open(self._segment_path(number), "xb")
+                    break
+                except FileExistsError:
+                    number += 1
+        else:
+            # Created and locked under a temporary name, then linked into place: replayers never
+            # see a segment before its writer holds the lock, and link() fails instead of
+            # overwriting, so two processes can't claim the same number
+            temp = os.path.join(self.directory, f".{SEGMENT_PREFIX}{os.getpid()}-{uuid.uuid4().hex}.tmp")
+            f = open(temp, "ab")
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            while True:
+                try:
+                    os.link(temp, self._segment_path(number))
+                    break
+                except FileExistsError:
+                    number += 1
+            os.remove(temp)
+        self._file = f
+        self._active_number = number
+
+    def rotate(self):
+        """Closes the active segment (if any) so it can be replayed."""
+        if self._file is None:
+            return
+        if self.fsync != "never":
+            self._sync()
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        self.rotate()
+
+    def lock_segment(self, path: str):
+        """
+        Opens and exclusively locks a segment for replay. Returns the open file (closing it
+        releases the lock), None if another process holds it, or raises FileNotFoundError
+        if it has already been replayed and deleted.
+        """
+        f = open(path, "rb")
+        if fcntl is None:
+            return f
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Another replayer may have deleted it between our open() and flock()
+            if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                raise FileNotFoundError(path)
+            return f
+        except BlockingIOError:
+            f.close()
+            return None
+        except BaseException:
+            f.close()
+            raise
+
+    def dead_letter(self, table: str, rows: List[dict], error: Exception):
+        line = json.dumps({"table": table, "rows": rows, "error": str(error), "failed_at": time.time()})
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as f:
+            f.write(line + "\n")
+        print(f"Spool: {len(rows)} {table} rows rejected by the DB, moved to {DEAD_LETTER_FILE}: {error}")
+
+    def segments(self) -> List[Tuple[str, bool]]:
+        """(path, whether it is this process's active segment) for every segment, oldest first."""
+        active = self._active_number if self._file is not None else None
+        return [(self._segment_path(n), n == active) for n in self._segment_numbers()]
+
+    def closed_segments(self) -> List[str]:
+        return [path for path, active in self.segments() if not active]
+
+    def pending_bytes(self) -> int:
+        total = self._file.tell() if self._file is not None else 0
+        for path in self.closed_segments():
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                # Just replayed by another process
+                pass
+        return total
+
+    def _segment_numbers(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(numbers)
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+
+    def metrics(self) -> dict:
+        return {
+            "records_written": self.records_written,
+            "bytes_written": self.bytes_written,
+            "pending_bytes": self.pending_bytes(),
+            "segments": len(self._segment_numbers()),
+        }
+
+def read_segment(path: str) -> Iterator[Tuple[int, bytes]]:
+    """Yields (kind, payload) for each intact record, stopping at a torn or corrupt tail."""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc, kind = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload, kind) != crc:
+            print(f"Spool: corrupt record at {path}:{offset}, skipping rest of segment")
+            return
+        yield kind, payload
+        offset = start + length
+
+class SpoolReplayer:
+    """
+    Uploads spooled records once the DB is reachable again, oldest segment first.
+    Uploads are upserts that ignore rows already present (study_sessions.id and
+    eeg_band_logs.client_id are the idempotency keys), so a segment that fails halfway
+    is simply replayed from the start next time.
+
+    Only transient errors (DB unreachable, timeouts) pause replay. Rows the DB rejects
+    outright (see supabase_client/errors.py) go to the dead-letter file, so one bad row
+    can't hold back every later segment.
+    """
+    def __init__(self, spool: Spool, interval: float, batch_size: int):
+        self.spool = spool
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.segments_replayed = 0
+        self.rows_replayed = 0
+        self.rows_dead_lettered = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.spool.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.replay()
+            except Exception as e:
+                self.failures += 1
+                print(f"Spool replay paused, DB still unavailable: {e}")
+
+    async def replay(self):
+        """
+        Replays segments oldest first (sessions must land before their band logs, and they may
+        be in another process's segment), stopping at one another process still holds.
+        """
+        for path, active in self.spool.segments():
+            if active:
+                # Everything older is uploaded, so the DB is reachable: close our active segment
+                # and upload it too. (Rotating only now keeps an outage from producing a new
+                # segment every interval.)
+                self.spool.rotate()
+            try:
+                lock = self.spool.lock_segment(path)
+            except FileNotFoundError:
+                continue
+            if lock is None:
+                return
+            try:
+                await self._replay_segment(path)
+                os.remove(path)
+                self.segments_replayed += 1
+            finally:
+                lock.close()
+
+    async def _replay_segment(self, path: str):
+        band_rows: List[dict] = []
+        for kind, payload in read_segment(path):
+            if kind == KIND_SESSION:
+                # Sessions before their band logs (foreign key), so flush what came earlier first
+                await self._upload_band_logs(band_rows)
+                band_rows = []
+                row = json.loads(payload)
+                await self._apply("study_sessions", [row], _upsert, "study_sessions", [row], "id")
+            elif kind == KIND_SESSION_END:
+                await self._replay_session_end(json.loads(payload))
+            elif kind == KIND_BAND_LOG:
+                band_rows.append(band_log_row(decode_band_log(payload)))
+                if len(band_rows) >= self.batch_size:
+                    await self._upload_band_logs(band_rows)
+                    band_rows = []
+        await self._upload_band_logs(band_rows)
+
+    async def _replay_session_end(self, end: dict):
+        # Updates are idempotent, so replaying one twice is harmless
+        try:
+            updated = await db_executor.run(update_session, end["id"], end["user_id"], end["fields"])
+        except Exception as e:
+            if not is_permanent_error(e):
+                raise
+            self._reject("study_sessions", [end], e)
+            return
+        if updated:
+            self.rows_replayed += 1
+        elif end.get("attempts", 0) + 1 < MAX_SESSION_END_ATTEMPTS:
+            self.spool.append_session_end(end["id"], end["user_id"], end["fields"], end.get("attempts", 0) + 1)
+        else:
+            self._reject("study_sessions", [end], Exception(f"No study_sessions row {end['id']} for user {end['user_id']}"))
+
+    async def _upload_band_logs(self, rows: List[dict]):
+        if not rows:
+            return
+        try:
+            await db_executor.run(_upsert, "eeg_band_logs", rows, "client_id")
+            self.rows_replayed += len(rows)
+            return
+        except Exception as e:
+            if not is_permanent_error(e):
+                raise
+            error = e
+        # Band logs are rejected because of their session (malformed id, no such session),
+        # so retry per session and dead-letter the sessions that still fail
+        by_session = {}
+        for row in rows:
+            by_session.setdefault(row["session_id"], []).append(row)
+        if len(by_session) == 1:
+            self._reject("eeg_band_logs", rows, error)
+            return
+        for group in by_session.values():
+            await self._apply("eeg_band_logs", group, _upsert, "eeg_band_logs", group, "client_id")
+
+    async def _apply(self, table: str, rows: List[dict], fn, *args):
+        """Runs one replay write; permanent rejections are dead-lettered, transient errors raised."""
+        try:
+            await db_executor.run(fn, *args)
+            self.rows_replayed += len(rows)
+        except Exception as e:
+            if not is_permanent_error(e):
+                raise
+            self._reject(table, rows, e)
+
+    def _reject(self, table: str, rows: List[dict], error: Exception):
+        self.spool.dead_letter(table, rows, error)
+        self.rows_dead_lettered += len(rows)
+
+    def metrics(self) -> dict:
+        return {
+            **self.spool.metrics(),
+            "segments_replayed": self.segments_replayed,
+            "rows_replayed": self.rows_replayed,
+            "rows_dead_lettered": self.rows_dead_lettered,
+            "replay_failures": self.failures,
+        }
+
+def band_log_row(row: dict) -> dict:
+    """Spooled/queued band log -> eeg_band_logs row (unix timestamp becomes an ISO timestamptz)."""
+    row = dict(row)
+    row["timestamp"] = datetime.fromtimestamp(row.pop("timestamp_unix"), timezone.utc).isoformat()
+    return row
+
+def update_session(session_id: str, user_id: str, fields: dict) -> int:
+    """Updates the user's session row; returns the number of rows updated (0 if it isn't there)."""
+    response = get_supabase().table("study_sessions").update(fields).eq("id", session_id).eq("user_id", user_id).execute()
+    return len(response.data or [])
+
+def _upsert(table: str, rows: List[dict], key: str):
+    get_supabase().table(table).upsert(rows, on_conflict=key, ignore_duplicates=True).execute()
+
+settings = get_settings()
+spool = Spool(
+    settings.SPOOL_DIR,
+    segment_bytes=settings.SPOOL_SEGMENT_BYTES,
+    fsync=settings.SPOOL_FSYNC,
+    fsync_interval=settings.SPOOL_FSYNC_INTERVAL_SEC
+)
+spool_replayer = SpoolReplayer(spool, interval=settings.SPOOL_REPLAY_INTERVAL_SEC, batch_size=settings.EEG_LOG_BATCH_SIZE)
@@ -0,0 +1,99 @@
+import asyncio
+from typing import List
+from core.auth import get_supabase
+from core.executor import db_executor
+from supabase_client.errors import is_permanent_error
+from supabase_client.rollups import WRITER_ID
+from eeg.summary import SessionSummary, SessionSummaryStore
+
+class SummarySync:
+    """
+    Persists this process's running session summaries to session_summary_parts, so a session
+    streamed in one uvicorn worker can be finalized by /sessions/end in another.
+
+    Every `interval` seconds each changed summary is upserted as this process's part (under
+    WRITER_ID); the process ending the session merges the other writers' parts into its own
+    (load_parts), so a part recorded elsewhere is at most `interval` seconds behind.
+    """
+    def __init__(self, store: SessionSummaryStore, interval: float):
+        self.store = store
+        self.interval = interval
+        self._task = None
+
+        # Metrics
+        self.parts_written = 0
+        self.parts_rejected = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.sync()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sync()
+
+    async def sync(self):
+        pending = self.store.take_dirty()
+        while pending:
+            summary = pending.pop(0)
+            row = {"session_id": summary.session_id, "writer_id": WRITER_ID,
+                   "user_id": summary.user_id, "state": summary.to_state()}
+            try:
+                await db_executor.run(_upsert_part, row)
+                self.parts_written += 1
+            except Exception as e:
+                if is_permanent_error(e):
+                    self.parts_rejected += 1
+                    print(f"Summary of session {summary.session_id} rejected by the DB, not persisting it: {e}")
+                    continue
+                self.failures += 1
+                print(f"Error persisting session summaries: {e}")
+                # DB unavailable: keep this and every remaining summary dirty for the next round
+                self.store.dirty.update(s.session_id for s in [summary] + pending)
+                break
+
+    async def load_parts(self, session_id: str, user_id: str) -> List[SessionSummary]:
+        """The user's parts of `session_id` recorded by other processes. Raises if the DB can't be asked."""
+        try:
+            rows = await db_executor.run(_select_parts, session_id, user_id)
+        except Exception as e:
+            if is_permanent_error(e):
+                # e.g. not a uuid: nothing was ever persisted for it
+                return []
+            raise
+        return [SessionSummary.from_state(session_id, user_id, self.store.artifact_threshold, row["state"])
+                for row in rows]
+
+    async def delete_parts(self, session_id: str):
+        """Drops a finalized session's parts; best effort (leftovers are only ever read by its end)."""
+        try:
+            await db_executor.run(_delete_parts, session_id)
+        except Exception as e:
+            print(f"Error deleting summary parts of session {session_id}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "dirty_summaries": len(self.store.dirty),
+            "parts_written": self.parts_written,
+            "parts_rejected": self.parts_rejected,
+            "failures": self.failures,
+        }
+
+def _upsert_part(row: dict):
+    get_supabase().table("session_summary_parts").upsert(row, on_conflict="session_id,writer_id").execute()
+
+def _select_parts(session_id: str, user_id: str):
+    return (get_supabase().table("session_summary_parts").select("state").eq("session_id", session_id)
+            .eq("user_id", user_id).neq("writer_id", WRITER_ID).execute().data)
+
+def _delete_parts(session_id: str):
+    get_supabase().table("session_summary_parts").delete().eq("session_id", session_id).execute()
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from core.config import get_settings
+from core.auth import get_supabase
+from supabase_client.spool import spool, band_log_row
+
+class BatchedTableWriter:
+    """
+    Background bulk-inserter for high-rate rows (eeg_band_logs).
+
+    Rows are appended to a bounded in-memory queue without touching the network.
+    A flush task sends them as one multi-row insert whenever `batch_size` rows are
+    waiting or `flush_interval` seconds have passed, running the blocking supabase-py
+    call on a small thread pool so the event loop never waits on HTTP.
+
+    Backpressure: only one insert per thread is in flight; while they are busy rows keep
+    queueing, and when the queue is full the oldest rows are handed to `spill` (or dropped
+    and counted if there is none). A failed batch is retried with backoff up to
+    `max_retries` times, then spilled.
+    """
+    RETRY_BACKOFF_SEC = 0.5
+
+    def __init__(self, table: str, batch_size: int, flush_interval: float, max_queue: int,
+                 max_retries: int = 3, threads: int = 1, insert: Optional[Callable[[str, List[dict]], None]] = None,
+                 spill: Optional[Callable[[List[dict]], None]] = None):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.threads = threads
+        self._insert = insert or _supabase_insert
+        self._spill = spill
+
+        self.queue: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+        # Metrics
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed_batches = 0
+        self.in_flight = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def enqueue(self, row: dict):
+        """Queues one row; never blocks. Drops the oldest row when the queue is full."""
+        if len(self.queue) >= self.max_queue:
+            self._discard([self.queue.popleft()])
+        self.queue.append(row)
+        self.enqueued += 1
+        if self._wakeup is not None and len(self.queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f"{self.table}-writer")
+        self._tasks = [asyncio.create_task(self._flush_loop()) for _ in range(self.threads)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Flushes whatever is still queued (bounded by `timeout`) and shuts the threads down."""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            self._discard(list(self.queue))
+            self.queue.clear()
+            print(f"{self.table} writer: shutdown flush timed out")
+        self._tasks = []
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    async def _flush_loop(self):
+        while True:
+            if len(self.queue) < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            if not self.queue:
+                if self._stopping:
+                    return
+                continue
+
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            await self._write(batch)
+
+    async def _write(self, batch: List[dict]):
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = time.perf_counter()
+                try:
+                    await loop.run_in_executor(self._executor, self._insert, self.table, batch)
+                    self.written += len(batch)
+                    self.last_flush_ms = (time.perf_counter() - started) * 1000
+                    return
+                except Exception as e:
+                    print(f"{self.table} writer: insert of {len(batch)} rows failed (attempt {attempt + 1}): {e}")
+                    if attempt < self.max_retries and not self._stopping:
+                        await asyncio.sleep(self.RETRY_BACKOFF_SEC * 2 ** attempt)
+                    else:
+                        break
+            self.failed_batches += 1
+            self._discard(batch)
+        except asyncio.CancelledError:
+            # stop() timed out mid-batch; the insert may still land, but band logs upsert on
+            # client_id, so spilling it too can't duplicate rows
+            self._discard(batch)
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def _discard(self, rows: List[dict]):
+        """Rows the DB path couldn't take: spill them if possible, otherwise count them as dropped."""
+        if self._spill is not None:
+            try:
+                self._spill(rows)
+                self.spilled += len(rows)
+                return
+            except Exception as e:
+                print(f"{self.table} writer: spill failed: {e}")
+        self.dropped += len(rows)
+
+    def metrics(self) -> dict:
+        return {
+            "queued": len(self.queue),
+            "in_flight": self.in_flight,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "failed_batches": self.failed_batches,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+        }
+
+def _supabase_insert(table: str, rows: List[dict]):
+    get_supabase().table(table).insert(rows).execute()
+
+def _insert_band_logs(table: str, rows: List[dict]):
+    # Upsert on client_id so a retried batch (e.g. after a timeout that did reach the DB) isn't duplicated
+    get_supabase().table(table).upsert([band_log_row(row) for row in rows], on_conflict="client_id",
+                                       ignore_duplicates=True).execute()
+
+settings = get_settings()
+band_log_writer = BatchedTableWriter(
+    "eeg_band_logs",
+    batch_size=settings.EEG_LOG_BATCH_SIZE,
+    flush_interval=settings.EEG_LOG_FLUSH_INTERVAL_SEC,
+    max_queue=settings.EEG_LOG_QUEUE_SIZE,
+    max_retries=settings.EEG_LOG_MAX_RETRIES,
+    threads=settings.EEG_LOG_WRITER_THREADS,
+    insert=_insert_band_logs,
+    # Rows the DB can't take right now go to the local spool and are replayed later
+    spill=spool.append_band_logs
+)
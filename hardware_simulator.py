@@ -2,63 +2,99 @@
 """
 Simple EEG Hardware Simulator
 Sends realistic EEG data via WebSocket for testing real hardware mode
+
+Produces full-rate sample blocks (default 250 Hz x 4 channels, sent 10 times per second)
+and can stand in for larger devices, e.g.:
+    python hardware_simulator.py --sample-rate 1000 --channels 32 --format binary
+
+Use --push to stream into the backend's ingest endpoint instead of waiting for a connection:
+    python hardware_simulator.py --format binary --push "ws://localhost:8000/ws/ingest?token=mock-token-123"
+
+Formats:
+  json   - one JSON message per block. "channels" keeps the latest value per channel for the
+           dashboard; "samples" carries the whole (channels x samples) block.
+  binary - one binary frame per block: FRAME_HEADER followed by channels*samples little-endian
+           float32 values, channel-major (row = channel). The first message is still the JSON
+           device_info, which describes the frame layout.
 """
 
+import argparse
 import asyncio
+import struct
 import websockets
 import json
 import time
 import random
-import math
+
+import numpy as np
+
+# Binary frame header: magic, version, flags, sequence, timestamp of first sample (unix s),
+# sample_rate (Hz), channels, samples per channel. Little-endian, 22 bytes.
+FRAME_HEADER = struct.Struct("<2sBBIdHHH")
+FRAME_MAGIC = b"NV"
+FRAME_VERSION = 1
+
+def pack_frame(seq, timestamp, sample_rate, block):
+    """Packs a (channels, samples) block into a binary frame."""
+    channels, samples = block.shape
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, 0, seq & 0xFFFFFFFF, timestamp, sample_rate, channels, samples)
+    return header + np.ascontiguousarray(block, dtype="<f4").tobytes()
 
 class EEGHardwareSimulator:
-    def __init__(self):
+    def __init__(self, channels=4, sample_rate=250, send_hz=10, frame_format="json", seed=None):
         self.is_running = False
-        self.channels = 4
-        self.sample_rate = 250
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.send_hz = send_hz
+        self.frame_format = frame_format
         self.current_state = "neutral"
-        
-    def generate_eeg_data(self):
-        """Generate realistic EEG data"""
-        timestamp = time.time()
-        
-        # Generate base EEG signals with different frequencies
-        signals = []
-        for ch in range(self.channels):
-            # Each channel has slightly different characteristics
-            base_freq = 10 + ch * 2  # Alpha range
-            signal = 0
-            
-            # Add different frequency components
-            # Delta (0.5-4 Hz)
-            signal += math.sin(2 * math.pi * 2 * timestamp) * random.uniform(5, 15)
-            
-            # Theta (4-8 Hz)
-            signal += math.sin(2 * math.pi * 6 * timestamp) * random.uniform(10, 20)
-            
-            # Alpha (8-13 Hz)
-            signal += math.sin(2 * math.pi * base_freq * timestamp) * random.uniform(20, 40)
-            
-            # Beta (13-30 Hz)
-            signal += math.sin(2 * math.pi * 20 * timestamp) * random.uniform(10, 25)
-            
-            # Gamma (30-50 Hz)
-            signal += math.sin(2 * math.pi * 40 * timestamp) * random.uniform(5, 15)
-            
-            # Add noise
-            signal += random.gauss(0, 5)
-            
-            signals.append(signal)
-        
+        self.rng = np.random.default_rng(seed)
+
+        # Per-channel oscillators (Hz): delta, theta, alpha (channel-specific), beta, gamma
+        alpha = 10 + 2 * (np.arange(channels) % 3)  # stays inside the alpha band
+        self.freqs = np.stack([
+            np.full(channels, 2.0),
+            np.full(channels, 6.0),
+            alpha.astype(float),
+            np.full(channels, 20.0),
+            np.full(channels, 40.0),
+        ], axis=1)
+        # Amplitude ranges (uV) per component
+        self.amp_low = np.array([5, 10, 20, 10, 5], dtype=float)
+        self.amp_high = np.array([15, 20, 40, 25, 15], dtype=float)
+        self.phases = self.rng.uniform(0, 2 * np.pi, self.freqs.shape)
+
+    def generate_block(self, start_index, num_samples):
+        """
+        Generate a (channels, samples) block of realistic EEG data.
+        Phase continues from start_index; component amplitudes vary from block to block.
+        """
+        t = (start_index + np.arange(num_samples)) / self.sample_rate
+        amplitudes = self.rng.uniform(self.amp_low, self.amp_high, self.freqs.shape)
+
+        # (channels, components, samples) -> sum over components
+        angles = 2 * np.pi * self.freqs[:, :, np.newaxis] * t + self.phases[:, :, np.newaxis]
+        block = np.einsum("ck,cks->cs", amplitudes, np.sin(angles))
+
+        # Add noise
+        block += self.rng.normal(0, 5, block.shape)
+        return block
+
+    def generate_eeg_data(self, block, timestamp, seq):
+        """Build the JSON message for one block"""
+        latest = block[:, -1].tolist()
+
         # Calculate band powers
-        bands = self.calculate_band_powers(signals)
-        
+        bands = self.calculate_band_powers(latest)
+
         # Determine brain state based on band powers
         state, confidence = self.determine_brain_state(bands)
-        
+
         return {
             "timestamp": timestamp,
-            "channels": signals,
+            "seq": seq,
+            "channels": latest,
+            "samples": block.tolist(),
             "bands": bands,
             "states": {
                 "focus": confidence if state == "focus" else random.randint(20, 40),
@@ -73,12 +109,12 @@ class EEGHardwareSimulator:
                 "sample_rate": self.sample_rate
             }
         }
-    
+
     def calculate_band_powers(self, signals):
         """Calculate approximate band power from signals"""
         # Simplified band power calculation
         avg_signal = sum(abs(s) for s in signals) / len(signals)
-        
+
         # Simulate band powers based on signal characteristics
         bands = {
             "delta": avg_signal * random.uniform(0.1, 0.3),
@@ -87,15 +123,15 @@ class EEGHardwareSimulator:
             "beta": avg_signal * random.uniform(0.2, 0.5),
             "gamma": avg_signal * random.uniform(0.1, 0.3)
         }
-        
+
         return bands
-    
+
     def determine_brain_state(self, bands):
         """Determine brain state from band powers"""
         alpha = bands["alpha"]
         beta = bands["beta"]
         theta = bands["theta"]
-        
+
         # Simple heuristics for brain state
         if beta > alpha * 1.2 and beta > theta:
             state = "focus"
@@ -109,33 +145,51 @@ class EEGHardwareSimulator:
         else:
             state = "neutral"
             confidence = 50
-        
+
         return state, confidence
-    
+
     async def simulate_device(self, websocket, path):
         """Handle WebSocket connection and send data"""
         print(f"Hardware simulator connected to {websocket.remote_address}")
-        
+
         try:
             # Send device info first
-            await websocket.send(json.dumps({
-                "type": "device_info",
-                "device": {
-                    "name": "Neurovex Headband Simulator",
-                    "type": "websocket",
-                    "version": "1.0.0",
-                    "channels": self.channels,
-                    "sample_rate": self.sample_rate
-                }
-            }))
-            
-            # Start sending EEG data
+            device = {
+                "name": "Neurovex Headband Simulator",
+                "type": "websocket",
+                "version": "1.1.0",
+                "channels": self.channels,
+                "sample_rate": self.sample_rate,
+                "format": self.frame_format
+            }
+            if self.frame_format == "binary":
+                device["frame_header"] = {"struct": FRAME_HEADER.format, "magic": FRAME_MAGIC.decode(),
+                                          "version": FRAME_VERSION, "payload": "float32 LE, channel-major"}
+            await websocket.send(json.dumps({"type": "device_info", "device": device}))
+
+            # Start sending EEG data: sample_rate / send_hz samples per block, on a drift-free schedule
             self.is_running = True
+            samples_per_block = max(1, int(round(self.sample_rate / self.send_hz)))
+            block_period = samples_per_block / self.sample_rate
+            loop = asyncio.get_running_loop()
+            start_time = time.time()
+            start_clock = loop.time()
+            sample_index = 0
+            seq = 0
+
             while self.is_running:
-                eeg_data = self.generate_eeg_data()
-                await websocket.send(json.dumps(eeg_data))
-                await asyncio.sleep(0.1)  # Send at 10Hz for demo purposes
-                
+                block = self.generate_block(sample_index, samples_per_block)
+                timestamp = start_time + sample_index / self.sample_rate
+                if self.frame_format == "binary":
+                    await websocket.send(pack_frame(seq, timestamp, self.sample_rate, block))
+                else:
+                    await websocket.send(json.dumps(self.generate_eeg_data(block, timestamp, seq)))
+
+                sample_index += samples_per_block
+                seq += 1
+                next_send = start_clock + seq * block_period
+                await asyncio.sleep(max(0.0, next_send - loop.time()))
+
         except websockets.exceptions.ConnectionClosed:
             print("Hardware simulator connection closed")
         except Exception as e:
@@ -143,26 +197,42 @@ class EEGHardwareSimulator:
         finally:
             self.is_running = False
 
-async def main():
+async def main(args):
     """Start the hardware simulator server"""
-    simulator = EEGHardwareSimulator()
-    
+    simulator = EEGHardwareSimulator(
+        channels=args.channels,
+        sample_rate=args.sample_rate,
+        send_hz=args.send_hz,
+        frame_format=args.format,
+        seed=args.seed
+    )
+
+    if args.push:
+        # Act as a device pushing into the backend (/ws/ingest) rather than a server
+        print(f"Pushing {args.channels} channels @ {args.sample_rate} Hz ({args.format}) to {args.push}")
+        async with websockets.connect(args.push, max_size=None) as websocket:
+            await simulator.simulate_device(websocket, None)
+        return
+
     print("Starting Neurovex Hardware Simulator...")
-    print("WebSocket server will run on ws://localhost:8082/eeg")
+    print(f"WebSocket server will run on ws://localhost:{args.port}/eeg")
+    print(f"{args.channels} channels @ {args.sample_rate} Hz, {args.send_hz} blocks/s, {args.format} frames")
     print("Connect to this from the dashboard to test real hardware mode")
-    
+
     # Start WebSocket server
-    async def handle_client(websocket, path):
+    async def handle_client(websocket, path=None):
+        # Newer websockets versions pass only the connection; the path is on the request
+        path = path or websocket.request.path
         if path == "/eeg":
             await simulator.simulate_device(websocket, path)
         else:
             await websocket.close(1000, "Path not found")
-    
-    server = await websockets.serve(handle_client, "localhost", 8082)
-    
+
+    server = await websockets.serve(handle_client, "localhost", args.port)
+
     print("Hardware simulator ready!")
     print("Dashboard should detect this as real hardware automatically")
-    
+
     try:
         await server.wait_closed()
     except KeyboardInterrupt:
@@ -170,4 +240,12 @@ async def main():
         simulator.is_running = False
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Neurovex EEG hardware simulator")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--sample-rate", type=int, default=250)
+    parser.add_argument("--send-hz", type=float, default=10.0, help="blocks sent per second")
+    parser.add_argument("--format", choices=["json", "binary"], default="json")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--push", default="", help="ingest URL to connect to and push data into, e.g. ws://localhost:8000/ws/ingest")
+    asyncio.run(main(parser.parse_args()))
@@ -37,7 +37,9 @@ const SessionAPI = {
             if (window.StreamManager && window.StreamManager.socket) {
                 window.StreamManager.socket.send(JSON.stringify({
                     action: "start_log",
-                    session_id: data.session_id
+                    session_id: data.session_id,
+                    // Identifies the recording's owner for their insights and session summary
+                    token: token
                 }));
             }
 
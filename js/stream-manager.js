@@ -10,13 +10,17 @@ class StreamManager {
         this.socket = null;
         this.isConnected = false;
         this.reconnectInterval = 3000;
+        // Signed-in dashboards identify themselves, so recordings and device data reach their user
+        this.useToken = true;
 
         this.connect();
     }
 
     connect() {
         console.log(`Connecting to Neurovex Backend: ${this.url}`);
-        this.socket = new WebSocket(this.url);
+        const token = this.useToken && window.StitchAuth ? StitchAuth.getToken() : null;
+        const url = token ? `${this.url}?token=${encodeURIComponent(token)}` : this.url;
+        this.socket = new WebSocket(url);
 
         this.socket.onopen = () => {
             console.log("Neurovex Stream Connected");
@@ -40,8 +44,12 @@ class StreamManager {
             }
         };
 
-        this.socket.onclose = () => {
+        this.socket.onclose = (event) => {
             console.warn("Neurovex Stream Disconnected. Retrying...");
+            if (event.code === 1008) {
+                // Token rejected (e.g. expired): fall back to the anonymous stream
+                this.useToken = false;
+            }
             this.isConnected = false;
             
             // Update state to show disconnection